@@ -0,0 +1,249 @@
+# ai_player.py
+# Computer player: information-set Monte Carlo search over the engine.
+#
+# The bot only sees what a human in its seat would: its own hand, the table
+# and how many cards everyone holds. Each iteration deals the unseen cards
+# into a random "determinization" (opponents' hands plus the deck), picks a
+# candidate move by UCB1, and plays the game out with a cheap random policy.
+# The most-visited move wins once the time budget is spent. With a process
+# pool every worker searches for the whole budget and their counts are summed.
+#
+#   python ai_player.py --games 200 --budget 0.1     # bot vs random players
+
+import argparse
+import json
+import math
+import random
+import time
+from multiprocessing import Pool
+
+from game_logic import (ALL_CARDS, FINES, Card, GameState, Player, calculate_card_points,
+                        disqualify_player, legal_moves)
+from simulate import play_turn
+
+MOVE_BUDGET = 0.15     # seconds of search per move
+ROLLOUT_TURNS = 60     # playouts longer than this are scored on points
+MAX_GAME_TURNS = 1000  # evaluation games (same cap as simulate.py)
+EXPLORATION = 0.7      # UCB1 constant
+DRAW = None            # the "take cards instead of playing" move
+
+# Information Set
+
+def observe(game, player):
+    """Everything `player` is allowed to know, as a picklable dict."""
+    scalars = game._scalars()
+    scalars.pop('top_card')
+    return {
+        'names': [p.name for p in game.players],
+        'seat': game.players.index(player),
+        'hand': [c.id for c in player.hand],
+        'counts': [len(p.hand) for p in game.players],
+        'eliminated': [p.eliminated for p in game.players],
+        'top': game.top_card.id,
+        'discard': [c.id for c in game.discard_pile],
+        'deck_size': len(game.deck),
+        'scalars': scalars,
+        'fines': game.fines,
+    }
+
+def determinize(info, rng):
+    """A full game consistent with `info`, hidden cards dealt at random."""
+    seen = set(info['hand'])
+    seen.update(info['discard'])
+    seen.add(info['top'])
+    unseen = [c for c in ALL_CARDS if c.id not in seen]
+    rng.shuffle(unseen)
+
+    game = GameState(log_file=None, undo_depth=0, rng=rng, fines=info['fines'], log_enabled=False)
+    players = []
+    for seat, name in enumerate(info['names']):
+        p = Player(name, None)
+        p.eliminated = info['eliminated'][seat]
+        if seat == info['seat']:
+            p.hand = [Card.from_id(i) for i in info['hand']]
+        else:
+            count = info['counts'][seat]
+            p.hand = unseen[:count]
+            del unseen[:count]
+        players.append(p)
+    game.players = players
+    # Whatever is left over (if the counts were short) goes to the deck
+    game.deck.cards = unseen
+    game.discard_pile = [Card.from_id(i) for i in info['discard']]
+    for name, value in info['scalars'].items():
+        setattr(game, name, value)
+    game.top_card = Card.from_id(info['top'])
+    return game
+
+# Playouts
+
+def take_cards(game, player):
+    """No play (or chose not to): pay the fine, or take one card, and pass."""
+    game.take_fine(player)
+
+def score(game, winner, seat):
+    me = game.players[seat]
+    if winner is None:
+        # Cut off: the share of opponents holding more points than us, since
+        # the heaviest hand is the one disqualified.
+        mine = calculate_card_points(me.hand)
+        others = [calculate_card_points(p.hand) for p in game.players
+                  if p is not me and not p.eliminated]
+        return sum(1.0 if pts > mine else 0.5 if pts == mine else 0.0
+                   for pts in others) / (len(others) or 1)
+    if winner == me.name:
+        return 1.0
+    return 0.0 if disqualify_player(game.players, winner) is me else 0.5
+
+def rollout(game, seat, move, rng):
+    """Plays `move` for `seat`, then random single cards until someone wins."""
+    player = game.players[seat]
+    if move is DRAW or not game.play_card(player, move):
+        take_cards(game, player)
+    else:
+        winner = game.check_victory()
+        if winner:
+            return score(game, winner, seat)
+    game.next_turn()
+
+    for _ in range(ROLLOUT_TURNS):
+        player = game.current_player()
+        playable = [c for c in player.hand if game.is_valid_play(c)]
+        if playable and game.play_card(player, [rng.choice(playable)]):
+            winner = game.check_victory()
+            if winner:
+                return score(game, winner, seat)
+        else:
+            take_cards(game, player)
+        game.next_turn()
+    return score(game, None, seat)
+
+# Search
+
+def search(info, moves, budget, seed=None):
+    """Flat UCB1 over `moves` (lists of card ids, or None to draw).
+
+    Returns ([visits, reward] per move, rollouts run).
+    """
+    rng = random.Random(seed)
+    moves = [None if m is None else [Card.from_id(i) for i in m] for m in moves]
+    stats = [[0, 0.0] for _ in moves]
+    deadline = time.perf_counter() + budget
+    rollouts = 0
+    while True:
+        if rollouts < len(moves):
+            index = rollouts  # try everything once first
+        else:
+            if time.perf_counter() >= deadline:
+                break
+            log_n = math.log(rollouts)
+            index = max(range(len(moves)), key=lambda i: stats[i][1] / stats[i][0]
+                        + EXPLORATION * math.sqrt(log_n / stats[i][0]))
+        reward = rollout(determinize(info, rng), info['seat'], moves[index], rng)
+        stats[index][0] += 1
+        stats[index][1] += reward
+        rollouts += 1
+    return stats, rollouts
+
+def _search_job(job):
+    return search(*job)
+
+def choose_move(game, player, budget=MOVE_BUDGET, rng=random, pool=None, workers=1, moves=None):
+    """Picks a move for `player`: a list of cards for play_card(), or None to draw.
+
+    `pool` (a multiprocessing.Pool) spreads the search over `workers` processes.
+    `moves` saves recomputing legal_moves() when the caller already has them.
+    """
+    if moves is None:
+        moves = legal_moves(player.hand, game)
+    if len(moves) <= 1:
+        return moves[0] if moves else None
+    # Drawing while holding a legal play is left out: it lowered the bot's
+    # win rate against random opponents and spread the rollouts thinner.
+    candidates = [[c.id for c in m] for m in moves]
+    info = observe(game, player)
+
+    if pool is not None and workers > 1:
+        jobs = [(info, candidates, budget, rng.random()) for _ in range(workers)]
+        results = pool.map(_search_job, jobs)
+        stats = [[sum(r[0][i][0] for r in results), sum(r[0][i][1] for r in results)]
+                 for i in range(len(candidates))]
+    else:
+        stats, _ = search(info, candidates, budget, rng.random())
+
+    best = max(range(len(candidates)), key=lambda i: (stats[i][0], stats[i][1]))
+    return moves[best]
+
+# Evaluation
+
+def play_match(rng, num_players, card_count, budget, pool=None, workers=1):
+    """One game: the bot in seat 0 against random legal-move players."""
+    game = GameState(log_file=None, undo_depth=0, rng=rng, fines=FINES, log_enabled=False)
+    players = [Player(f"P{i + 1}", None) for i in range(num_players)]
+    game.initialize_game(players, card_count)
+    thinking = []
+
+    def policy(moves, rng):
+        player = game.current_player()
+        if player is not players[0]:
+            return rng.choice(moves)
+        start = time.perf_counter()
+        move = choose_move(game, player, budget, rng, pool, workers, moves)
+        thinking.append(time.perf_counter() - start)
+        return move
+
+    for _ in range(MAX_GAME_TURNS):
+        winner = play_turn(game, policy, rng)
+        if winner:
+            return winner, disqualify_player(players, winner).name, thinking
+    return None, None, thinking
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo bot vs random players")
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--cards', type=int, default=3)
+    parser.add_argument('--budget', type=float, default=MOVE_BUDGET, help="seconds per move")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rollouts', action='store_true',
+                        help="only measure rollouts per second from one position")
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    if args.rollouts:
+        game = GameState(log_file=None, undo_depth=0, rng=rng, log_enabled=False)
+        game.initialize_game([Player(f"P{i + 1}", None) for i in range(args.players)], args.cards)
+        info = observe(game, game.players[0])
+        moves = [[c.id for c in m] for m in legal_moves(game.players[0].hand, game)] + [DRAW]
+        _, rollouts = search(info, moves, args.budget * 10, args.seed)
+        print(json.dumps({'rollouts_per_second': round(rollouts / (args.budget * 10))}))
+        return
+
+    pool = Pool(args.workers) if args.workers > 1 else None
+    wins = disqualified = finished = 0
+    thinking = []
+    try:
+        for _ in range(args.games):
+            winner, loser, times = play_match(rng, args.players, args.cards, args.budget,
+                                              pool, args.workers)
+            thinking += times
+            finished += winner is not None
+            wins += winner == 'P1'
+            disqualified += loser == 'P1'
+    finally:
+        if pool:
+            pool.close()
+    thinking.sort()
+    print(json.dumps({
+        'games': args.games,
+        'finished': finished,
+        'bot_win_rate': round(wins / (finished or 1), 3),
+        'bot_disqualified_rate': round(disqualified / (finished or 1), 3),
+        'random_seat_win_rate': round(1 / args.players, 3),
+        'think_ms_p50': round(thinking[len(thinking) // 2] * 1000, 1) if thinking else None,
+        'think_ms_max': round(thinking[-1] * 1000, 1) if thinking else None,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
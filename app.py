@@ -1,15 +1,15 @@
 # app.py
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
-import hashlib
 import json
 import os
 import uuid
 import time
 import random
 import io
-from db import init_db, save_game_state, load_game_state, list_games
-from backup_utils import startup_backup_routine
+import metrics
+from db import (init_db, save_game_state, load_game_state, load_from_db, list_games, get_version,
+                get_log_tail, StaleGameError)
+from backup_utils import startup_backup_routine, periodic_cleanup, check_game
 from game_logic import Deck, Card, Player, play_card, check_victory, current_player, next_turn, is_valid_play, calculate_card_points, disqualify_player
 import io
 from reportlab.lib.pagesizes import letter
@@ -51,22 +51,61 @@ def card_display(card):
     suit, rank = card[0], card[1]
     return f"{rank} {SUIT_SYMBOLS.get(suit, '')}"
 
+# Seconds a cached game listing stays fresh; creating a game clears it
+LISTING_TTL = 5
+# Log lines shown by "Show Log"
+LOG_LINES = 50
+
+@st.cache_data(ttl=LISTING_TTL)
+def cached_list_games():
+    return list_games()
+
+@st.cache_data(max_entries=256)
+def load_game_at_version(game_code, version):
+    """Decoded game state, shared by every session while the version holds.
+
+    Streamlit hands each caller its own copy, so callers may mutate it.
+    """
+    return load_game_state(game_code, with_version=True)
+
+def load_current_game(game_code):
+    """One version lookup, then a full load only if the version is new."""
+    version = get_version(game_code)
+    if version is None:
+        return None
+    return load_game_at_version(game_code, version)
+
 def get_game_state():
-    state_data = load_game_state(game_code)
+    state_data = load_current_game(game_code)
     if not state_data:
         st.stop()
-    return state_data
-
-def hash_state(state):
-    relevant = {
-        "top_card": state["top_card"],
-        "turn_index": state["turn_index"],
-        "fine": state["fine"],
-        "requested_suit": state.get("requested_suit"),
-        "requested_rank": state.get("requested_rank"),
-        "log": state["log"][-3:]  # Only last 3 events to avoid over-refresh
-    }
-    return hashlib.md5(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+    state, players, version = state_data
+    st.session_state.seen_version = version
+    return state, players
+
+def save_checked(state, players):
+    """Saves only if nobody else wrote the game since this page loaded it."""
+    try:
+        st.session_state.seen_version = save_game_state(
+            game_code, state, players, expected_version=st.session_state.seen_version)
+    except StaleGameError:
+        st.warning("The game changed while you were playing. Reloading...")
+        st.rerun()
+
+# Seconds between version checks while waiting for other players
+SYNC_INTERVAL = 0.5
+
+@st.fragment(run_every=SYNC_INTERVAL)
+def watch_game(game_code, seen_version, deadline=None):
+    """Reruns the page only once the stored game has moved past seen_version.
+
+    Only this fragment reruns on the timer, and all it does is one version
+    lookup, so waiting players no longer reload the whole game every tick.
+    """
+    if get_version(game_code) != seen_version:
+        st.rerun()
+    if deadline and time.time() >= deadline:
+        st.rerun()
 
 DB_FILE = "game.db"
 BACKUP_DIR = "game_states"
@@ -81,7 +120,9 @@ def prepare_and_save_game_state(game_code, state, players):
     }
     save_game_state(game_code, state, serialized_players)  # calls the original one from db.py
 
-
+# Static for the life of the process: built once, not on every rerun
+@st.cache_resource
+def create_rules_pdf():
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=letter)
     width, height = letter
@@ -113,12 +154,26 @@ def prepare_and_save_game_state(game_code, state, players):
 
     c.showPage()
     c.save()
-    buffer.seek(0)
-    return buffer
+    return buffer.getvalue()
+
+# DB and backup timings are recorded in this process, so serve them from
+# here too: once per process, and only when KARATA_METRICS is set.
+@st.cache_resource
+def start_metrics_server():
+    port = int(os.environ.get('KARATA_METRICS_PORT', metrics.METRICS_PORT))
+    try:
+        return metrics.serve_metrics(port=port)
+    except OSError as e:
+        print(f"[METRICS ERROR] Could not serve metrics on port {port}: {e}")
+        return None
+
+if metrics.enabled():
+    start_metrics_server()
 
 st.title("🃏 Karata ya Kushuka")
 init_db()
-startup_backup_routine(list_games, lambda code: load_from_db(code))
+# Both run once per process in the background; games are checked lazily on open
+startup_backup_routine(list_games, load_from_db, lazy=True)
 periodic_cleanup()
 
 
@@ -140,7 +195,7 @@ if 'requested_rank' not in st.session_state:
 
 # Sidebar controls
 st.sidebar.header("Join or Create Game")
-available_games = list_games()
+available_games = cached_list_games()
 if available_games:
     selected_game = st.sidebar.selectbox("Available Games", available_games)
     if st.sidebar.button("Join Selected Game"):
@@ -154,9 +209,10 @@ st.session_state.lobby_password = st.sidebar.text_input("Lobby Password (optiona
 resume_name = ""
 if st.session_state.game_code:
     game_code = st.session_state.game_code
-    state_data = load_game_state(game_code)
+    check_game(game_code, load_from_db)
+    state_data = load_current_game(game_code)
     if state_data:
-        state, players = state_data
+        state, players, _ = state_data
         for name, pid in state.get('player_ids', {}).items():
             if pid == st.session_state.player_id:
                 resume_name = name
@@ -175,7 +231,7 @@ if st.session_state.game_code and st.session_state.player_name:
     player_id = st.session_state.player_id
     lobby_password = st.session_state.lobby_password
 
-    state_data = load_game_state(game_code)
+    state_data = load_current_game(game_code)
 
     if not state_data:
         max_players = st.sidebar.number_input("Max Players", 3, 10, 6, key="max_players")
@@ -183,45 +239,42 @@ if st.session_state.game_code and st.session_state.player_name:
             d = Deck()
             top = d.draw()
             hand = [d.draw() for _ in range(3)]
-            save_game_state(game_code, {
-                'top_card': top.to_tuple(),
-                'deck': d.to_list(),
-                'discard_pile': [],
-                'turn_index': 0,
-                'direction': 1,
-                'fine': 0,
-                'question_pending': False,
-                'question_rank': '',
-                'requested_suit': None,
-                'requested_rank': None,
-                'log': [],
-                'started': False,
-                'max_players': max_players,
-                'host': player_name,
-                'player_ids': {player_name: player_id},
-                'lobby_password': lobby_password,
-                'history': [],
-                'countdown_start': None,
-                'eliminated': []
-            }, {player_name: [c.to_tuple() for c in hand]})
+            try:
+                save_game_state(game_code, {
+                    'top_card': top.to_tuple(),
+                    'deck': d.to_list(),
+                    'discard_pile': [],
+                    'turn_index': 0,
+                    'direction': 1,
+                    'fine': 0,
+                    'question_pending': False,
+                    'question_rank': '',
+                    'requested_suit': None,
+                    'requested_rank': None,
+                    'log': [],
+                    'started': False,
+                    'max_players': max_players,
+                    'host': player_name,
+                    'player_ids': {player_name: player_id},
+                    'lobby_password': lobby_password,
+                    'history': [],
+                    'countdown_start': None,
+                    'eliminated': []
+                }, {player_name: [c.to_tuple() for c in hand]}, expected_version=0)
+            except StaleGameError:
+                pass  # someone else created it first; the rerun joins their game
+            cached_list_games.clear()
             st.rerun()
     else:
         state, players = get_game_state()
         turn_player = list(players.keys())[state['turn_index']]
         player_name = st.session_state.player_name
 
-# 🧠 Hash-based sync detection (optional)
-        if 'state_hash' not in st.session_state:
-            st.session_state.state_hash = ""
-
-        new_hash = hash_state(state)
-        if new_hash != st.session_state.state_hash:
-            st.session_state.state_hash = new_hash
-            st.rerun()
-
-# 🔁 Always refresh when game hasn’t started or it’s not your turn
+# 🔁 Re-render when the game changes while it hasn’t started or it’s not your turn
         if not state.get('started') or player_name != turn_player:
-            st_autorefresh(interval=3000, key="sync")
+            # While the start countdown runs, also tick once a second
+            tick = time.time() + 1 if state.get('countdown_start') else None
+            watch_game(game_code, st.session_state.seen_version, tick)
 
         if state.get('lobby_password') and state['lobby_password'] != lobby_password:
             st.error("Incorrect password for this lobby.")
@@ -244,19 +297,19 @@ if st.session_state.game_code and st.session_state.player_name:
             players[player_name] = [c.to_tuple() for c in hand]
             state['log'].append(f"{player_name} joined the game.")
             state.setdefault('player_ids', {})[player_name] = player_id
-            save_game_state(game_code, state, players)
+            save_checked(state, players)
             st.rerun()
 
         if not state.get('started'):
             if player_count == max_players:
                 if not state.get('countdown_start'):
                     state['countdown_start'] = time.time()
-                    save_game_state(game_code, state, players)
+                    save_checked(state, players)
 
                 remaining = 10 - int(time.time() - state['countdown_start'])
                 if remaining <= 0:
                     state['started'] = True
-                    save_game_state(game_code, state, players)
+                    save_checked(state, players)
                     st.success("Game auto-started.")
                     st.rerun()
                 else:
@@ -264,7 +317,7 @@ if st.session_state.game_code and st.session_state.player_name:
             elif player_name == host and player_count >= 3:
                 if st.button("Start Game"):
                     state['started'] = True
-                    save_game_state(game_code, state, players)
+                    save_checked(state, players)
                     st.success("Game started.")
                     st.rerun()
             else:
@@ -280,7 +333,6 @@ if st.session_state.game_code and st.session_state.player_name:
         st.markdown(f"**Turn:** {turn_player}")
 
         if player_name != turn_player:
-            st_autorefresh(interval=3000, key="refresh")
             st.warning("Not your turn.")
             st.stop()
 
@@ -320,10 +372,10 @@ if st.session_state.game_code and st.session_state.player_name:
                             players[p] = [Card(s, r).to_tuple() for s, r in Deck().draw() for _ in range(3)]
                         state['started'] = False
                         state['log'].append("New round starting...")
-                        save_game_state(game_code, state, players)
+                        save_checked(state, players)
                         st.rerun()
 
-                    save_game_state(game_code, state, players)
+                    save_checked(state, players)
                     st.rerun()
                 else:
                     st.error("Invalid play.")
@@ -345,7 +397,7 @@ if st.session_state.game_code and st.session_state.player_name:
                     state['log'].append(f"{player_name} drew a card.")
                     state['turn_index'] = (state['turn_index'] + state['direction']) % len(players)
                     players[player_name] = hand
-                    save_game_state(game_code, state, players)
+                    save_checked(state, players)
                     st.rerun()
                 else:
                     st.warning("Deck is empty.")
@@ -354,8 +406,8 @@ if st.session_state.game_code and st.session_state.player_name:
             if st.button("Pass"):
                 state['turn_index'] = (state['turn_index'] + state['direction']) % len(players)
                 state['log'].append(f"{player_name} passed.")
-                save_game_state(game_code, state, players)
+                save_checked(state, players)
                 st.rerun()
 
         if st.button("📜 Show Log"):
-            st.code("\n".join(state['log']))
+            st.code("\n".join(get_log_tail(game_code, LOG_LINES)))
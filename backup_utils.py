@@ -3,16 +3,24 @@ import json
 import shutil
 import time
 import glob
+import hashlib
 import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from cryptography.fernet import Fernet
-from db import save_to_db, load_from_db, init_db, DB_FILE
+import metrics
+from db import save_to_db, load_from_db, init_db, get_connection, DB_FILE
 
 # Constants
 BACKUP_DIR = "game_states"
 ENCRYPTION_KEY_FILE = "backup.key"
 MAX_BACKUP_AGE_MINUTES = 60
-GAME_FORMAT_VERSION = "v1.0"
+GAME_FORMAT_VERSION = "v2.0"  # v2: zlib-compressed payloads, full backups plus deltas
+FULL_BACKUP_EVERY = 20         # saves per chain: one full backup, then deltas
+COMPRESS_LEVEL = 6
+INDEX_FILE = os.path.join(BACKUP_DIR, "backup_index.db")
+RECOVERY_WORKERS = 8
 
 # --- Encryption Handling ---
 def get_encryption_key():
@@ -29,35 +37,292 @@ def get_encryption_key():
 fernet = Fernet(get_encryption_key())
 
 def encrypt_json(data: dict) -> bytes:
-    return fernet.encrypt(json.dumps(data).encode())
+    """Compresses before encrypting so Fernet's base64 pads a smaller payload."""
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return fernet.encrypt(zlib.compress(raw, COMPRESS_LEVEL))
 
 def decrypt_json(data: bytes) -> dict:
-    return json.loads(fernet.decrypt(data).decode())
+    raw = fernet.decrypt(data)
+    if not raw.startswith(b"{"):  # v1 backups were stored uncompressed
+        raw = zlib.decompress(raw)
+    return json.loads(raw)
+
+def write_atomic(path: str, data: bytes):
+    """Writes via a temp file and rename so a crash never leaves half a backup."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# --- Deltas ---
+# A delta holds, per top-level key, either a new value, the items appended
+# to a list, or the length a list was cut back to (cards drawn off the deck).
+def diff_dict(old: dict, new: dict) -> dict:
+    delta = {}
+    for key, value in new.items():
+        if key not in old:
+            delta.setdefault("set", {})[key] = value
+            continue
+        prev = old[key]
+        if prev == value:
+            continue
+        if isinstance(prev, list) and isinstance(value, list):
+            if len(value) > len(prev) and value[:len(prev)] == prev:
+                delta.setdefault("append", {})[key] = value[len(prev):]
+                continue
+            if len(value) < len(prev) and prev[:len(value)] == value:
+                delta.setdefault("trim", {})[key] = len(value)
+                continue
+        delta.setdefault("set", {})[key] = value
+    removed = [key for key in old if key not in new]
+    if removed:
+        delta["del"] = removed
+    return delta
+
+def diff_value(old, new) -> dict:
+    if isinstance(old, dict) and isinstance(new, dict):
+        return diff_dict(old, new)
+    return {"replace": new}
+
+def apply_delta(data, delta: dict):
+    if "replace" in delta:
+        return delta["replace"]
+    data.update(delta.get("set", {}))
+    for key, items in delta.get("append", {}).items():
+        data[key].extend(items)
+    for key, length in delta.get("trim", {}).items():
+        del data[key][length:]
+    for key in delta.get("del", []):
+        data.pop(key, None)
+    return data
+
+# --- Metadata Index ---
+# Plaintext SQLite index of every backup file, so listing, verification and
+# cleanup never have to decrypt anything. backup_games keeps one row per game
+# with the time of its newest save, which makes retention a range query.
+INDEX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS backup_files (
+        path TEXT PRIMARY KEY,
+        game_code TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        chain TEXT,
+        seq INTEGER NOT NULL DEFAULT 0,
+        version TEXT NOT NULL,
+        timestamp REAL NOT NULL,
+        size INTEGER NOT NULL,
+        checksum TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS backup_files_game ON backup_files (game_code);
+    CREATE TABLE IF NOT EXISTS backup_games (
+        game_code TEXT PRIMARY KEY,
+        chain TEXT,
+        last_timestamp REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS backup_games_age ON backup_games (last_timestamp);
+"""
+
+def get_index():
+    """Lends a pooled connection to the backup index, creating the index once."""
+    if not getattr(get_index, "ready", False):
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        with get_connection(INDEX_FILE) as conn:
+            conn.executescript(INDEX_SCHEMA)
+        get_index.ready = True
+    return get_connection(INDEX_FILE)
+
+def index_backup_file(path: str, game_code: str, meta: dict, data: bytes):
+    with get_index() as conn:
+        if meta.get("seq", 0) == 0:
+            # A new full backup starts a new chain; older rows are superseded
+            conn.execute("DELETE FROM backup_files WHERE game_code = ?", (game_code,))
+        conn.execute("""
+            INSERT OR REPLACE INTO backup_files
+                (path, game_code, kind, chain, seq, version, timestamp, size, checksum)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (os.path.basename(path), game_code, "delta" if meta.get("seq") else "full",
+              meta.get("chain"), meta.get("seq", 0), meta.get("version", "v1.0"),
+              meta.get("timestamp", 0), len(data), hashlib.sha256(data).hexdigest()))
+        conn.execute("""
+            INSERT INTO backup_games (game_code, chain, last_timestamp) VALUES (?, ?, ?)
+            ON CONFLICT(game_code) DO UPDATE SET
+                chain = excluded.chain,
+                last_timestamp = MAX(last_timestamp, excluded.last_timestamp)
+        """, (game_code, meta.get("chain"), meta.get("timestamp", 0)))
+
+def unindex_game(game_code: str):
+    with get_index() as conn:
+        conn.execute("DELETE FROM backup_files WHERE game_code = ?", (game_code,))
+        conn.execute("DELETE FROM backup_games WHERE game_code = ?", (game_code,))
+
+def list_backups():
+    """Returns [(game_code, last_timestamp)] for every backed-up game, newest first."""
+    with get_index() as conn:
+        return conn.execute(
+            "SELECT game_code, last_timestamp FROM backup_games ORDER BY last_timestamp DESC"
+        ).fetchall()
+
+def has_backup(game_code: str) -> bool:
+    with get_index() as conn:
+        return conn.execute("SELECT 1 FROM backup_games WHERE game_code = ?",
+                            (game_code,)).fetchone() is not None
+
+def verify_backup(game_code: str) -> bool:
+    """Checks that a game has a full backup followed by deltas 1, 2, ... of the
+    same chain, and that every file matches its recorded size and checksum."""
+    with get_index() as conn:
+        rows = conn.execute(
+            "SELECT path, kind, chain, seq, size, checksum FROM backup_files "
+            "WHERE game_code = ? ORDER BY seq", (game_code,)).fetchall()
+    if not rows or rows[0][1] != "full":
+        return False
+    chain = rows[0][2]
+    for expected, (_, kind, row_chain, seq, _, _) in enumerate(rows):
+        if seq != expected or row_chain != chain or (kind == "full") != (seq == 0):
+            return False
+    for name, _, _, _, size, checksum in rows:
+        path = os.path.join(BACKUP_DIR, name)
+        try:
+            if os.path.getsize(path) != size:
+                return False
+            with open(path, "rb") as f:
+                if hashlib.sha256(f.read()).hexdigest() != checksum:
+                    return False
+        except OSError:
+            return False
+    return True
+
+def index_unknown_files():
+    """Indexes backups written before the index existed. Each such file is
+    decrypted once here and never again."""
+    with get_index() as conn:
+        known = {row[0] for row in conn.execute("SELECT path FROM backup_files")}
+    # Full backups first so their deltas can be matched to the current chain
+    paths = sorted(glob.glob(f"{BACKUP_DIR}/*.enc"), key=lambda p: (".delta." in p, p))
+    for path in paths:
+        name = os.path.basename(path)
+        if name in known:
+            continue
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            meta = decrypt_json(data)
+            if ".delta." in name:
+                game_code = name.split(".delta.")[0]
+                with get_index() as conn:
+                    row = conn.execute("SELECT chain FROM backup_games WHERE game_code = ?",
+                                       (game_code,)).fetchone()
+                if not row or row[0] != meta.get("chain"):
+                    os.remove(path)  # left over from a superseded chain
+                    continue
+            else:
+                game_code = name[:-len(".json.enc")]
+            index_backup_file(path, game_code, meta, data)
+        except Exception as e:
+            print(f"[INDEX ERROR] Skipping {name}: {e}")
+
+# game_code -> {"chain", "seq", "state", "players"} for the last backup
+# written by this process. A fresh process always starts with a full backup.
+# Each game's backups are written under that game's own lock, so one game's
+# compression and disk I/O never hold up another's.
+_chains = {}
+_game_locks = {}
+_game_locks_lock = threading.Lock()
+
+def _game_lock(game_code: str) -> threading.Lock:
+    with _game_locks_lock:
+        lock = _game_locks.get(game_code)
+        if lock is None:
+            lock = _game_locks[game_code] = threading.Lock()
+        return lock
 
 # --- Backup Operations ---
-def save_backup_file(game_code: str, state: dict, players: list):
-    """Saves encrypted backup to disk."""
+def full_backup_path(game_code: str) -> str:
+    return os.path.join(BACKUP_DIR, f"{game_code}.json.enc")
+
+def delta_backup_path(game_code: str, seq: int) -> str:
+    return os.path.join(BACKUP_DIR, f"{game_code}.delta.{seq}.enc")
+
+def delta_backup_paths(game_code: str):
+    return glob.glob(os.path.join(BACKUP_DIR, f"{glob.escape(game_code)}.delta.*.enc"))
+
+def remove_backups(game_code: str):
+    """Deletes all of a game's backups. Its next save starts a new full backup."""
+    with _game_lock(game_code):
+        _remove_files(game_code)
+        _chains.pop(game_code, None)
+
+def _remove_files(game_code: str, full=True):
+    """Deletes a game's deltas, and its full backup unless full=False.
+    The caller holds the game's lock."""
+    paths = delta_backup_paths(game_code)
+    if full:
+        paths.append(full_backup_path(game_code))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    if full:
+        unindex_game(game_code)
+
+@metrics.timed('backup_save')
+def save_backup_file(game_code: str, state: dict, players):
+    """Saves an encrypted backup: a full snapshot every FULL_BACKUP_EVERY saves,
+    otherwise a small delta against the previous save."""
     os.makedirs(BACKUP_DIR, exist_ok=True)
-    backup_data = {
-        "version": GAME_FORMAT_VERSION,
-        "timestamp": time.time(),
-        "state": state,
-        "players": players
-    }
-    path = os.path.join(BACKUP_DIR, f"{game_code}.json.enc")
+    # Detached copy: callers keep mutating the dicts they pass in
+    state, players = json.loads(json.dumps([state, players]))
+    now = time.time()
     try:
-        with open(path, "wb") as f:
-            f.write(encrypt_json(backup_data))
+        with _game_lock(game_code):
+            chain = _chains.get(game_code)
+            if chain is None or chain["seq"] + 1 >= FULL_BACKUP_EVERY:
+                chain_id = f"{now:.6f}"
+                meta = {"version": GAME_FORMAT_VERSION, "timestamp": now, "chain": chain_id}
+                data = encrypt_json({**meta, "state": state, "players": players})
+                write_atomic(full_backup_path(game_code), data)
+                metrics.inc('backup_bytes', len(data), kind='full')
+                index_backup_file(full_backup_path(game_code), game_code, meta, data)
+                # Deltas of the old chain are now superseded (and ignored on
+                # load even if this process dies before removing them).
+                _remove_files(game_code, full=False)
+                _chains[game_code] = {"chain": chain_id, "seq": 0, "state": state, "players": players}
+                return
+            seq = chain["seq"] + 1
+            meta = {"version": GAME_FORMAT_VERSION, "timestamp": now, "chain": chain["chain"], "seq": seq}
+            data = encrypt_json({
+                **meta,
+                "state": diff_value(chain["state"], state),
+                "players": diff_value(chain["players"], players)
+            })
+            write_atomic(delta_backup_path(game_code, seq), data)
+            metrics.inc('backup_bytes', len(data), kind='delta')
+            index_backup_file(delta_backup_path(game_code, seq), game_code, meta, data)
+            chain.update(seq=seq, state=state, players=players)
     except Exception as e:
+        _chains.pop(game_code, None)
+        metrics.inc('backup_save_errors')
         print(f"[BACKUP ERROR] Could not save backup: {e}")
 
+@metrics.timed('backup_load')
 def load_backup_file(game_code: str):
-    """Loads and decrypts backup data from disk."""
-    path = os.path.join(BACKUP_DIR, f"{game_code}.json.enc")
+    """Loads the full backup and replays its deltas in order."""
+    path = full_backup_path(game_code)
     if not os.path.exists(path): return None
     try:
         with open(path, "rb") as f:
-            return decrypt_json(f.read())
+            backup = decrypt_json(f.read())
+        seq = 1
+        while os.path.exists(delta_backup_path(game_code, seq)):
+            with open(delta_backup_path(game_code, seq), "rb") as f:
+                delta = decrypt_json(f.read())
+            if delta.get("chain") != backup.get("chain"):
+                break
+            backup["state"] = apply_delta(backup["state"], delta["state"])
+            backup["players"] = apply_delta(backup["players"], delta["players"])
+            backup["timestamp"] = delta["timestamp"]
+            seq += 1
+        return backup
     except Exception as e:
         print(f"[DECRYPT ERROR] Failed to decrypt {game_code}: {e}")
         return None
@@ -86,38 +351,86 @@ def auto_backup(game_code: str, state: dict, players: list):
         print(f"[FILE BACKUP FAIL] {e}")
 
 # --- Startup & Cleanup ---
-def startup_backup_routine(list_games_fn, load_fn):
-    """On app start: ensures DB is synced, attempts recovery, and cleans up old backups."""
+# Recovery runs once per process in a background thread, so importing the
+# app never waits on it. Games are checked in parallel, or with lazy=True
+# only when first opened through check_game().
+_recovery_lock = threading.Lock()
+_recovery_thread = None
+_cleanup_thread = None
+_checked = set()
+
+def check_game(game_code: str, load_fn) -> bool:
+    """Makes sure a game loads, restoring it from backup if it does not.
+    Each game is checked at most once per process."""
+    if game_code in _checked:
+        return True
+    try:
+        load_fn(game_code)
+        ok = True
+    except Exception:
+        if not has_backup(game_code):
+            return False  # a new game code, nothing to recover
+        print(f"[RECOVERY] DB missing for {game_code}, restoring from backup...")
+        ok = verify_backup(game_code) and restore_db_from_backup(game_code)
+        if not ok:
+            print(f"[RECOVERY FAIL] Could not recover {game_code}")
+    if ok:
+        with _recovery_lock:
+            _checked.add(game_code)
+    return ok
+
+def startup_backup_routine(list_games_fn, load_fn, lazy=False):
+    """On app start: ensures DB is synced, attempts recovery, and cleans up old backups.
+
+    Starts the work in a background thread the first time it is called in a
+    process and returns that thread; later calls return the same thread.
+    """
+    global _recovery_thread
+    with _recovery_lock:
+        if _recovery_thread is None:
+            _recovery_thread = threading.Thread(
+                target=_run_startup, args=(list_games_fn, load_fn, lazy),
+                name="backup-recovery", daemon=True)
+            _recovery_thread.start()
+        return _recovery_thread
+
+def _run_startup(list_games_fn, load_fn, lazy):
     print("[STARTUP] Verifying backups...")
     os.makedirs(BACKUP_DIR, exist_ok=True)
-    for game_code in list_games_fn():
-        try:
-            load_fn(game_code)
-        except Exception:
-            print(f"[RECOVERY] DB missing for {game_code}, restoring from backup...")
-            restored = restore_db_from_backup(game_code)
-            if not restored:
-                print(f"[RECOVERY FAIL] Could not recover {game_code}")
-    cleanup_old_backups()
+    try:
+        index_unknown_files()
+        if not lazy:
+            # Games in the DB plus games that only survive as backups
+            codes = set(list_games_fn()) | {code for code, _ in list_backups()}
+            with ThreadPoolExecutor(RECOVERY_WORKERS) as pool:
+                list(pool.map(lambda code: check_game(code, load_fn), codes))
+        cleanup_old_backups()
+    except Exception as e:
+        print(f"[STARTUP ERROR] {e}")
 
 def cleanup_old_backups():
-    """Deletes outdated backup files."""
-    now = time.time()
-    for path in glob.glob(f"{BACKUP_DIR}/*.json.enc"):
+    """Deletes backup chains whose newest save is outdated, using only the index."""
+    index_unknown_files()
+    cutoff = time.time() - MAX_BACKUP_AGE_MINUTES * 60
+    with get_index() as conn:
+        expired = [row[0] for row in conn.execute(
+            "SELECT game_code FROM backup_games WHERE last_timestamp < ?", (cutoff,))]
+    for game_code in expired:
         try:
-            with open(path, "rb") as f:
-                data = decrypt_json(f.read())
-            timestamp = data.get("timestamp", 0)
-            if now - timestamp > MAX_BACKUP_AGE_MINUTES * 60:
-                os.remove(path)
-                print(f"[CLEANUP] Removed old backup: {path}")
+            remove_backups(game_code)
+            print(f"[CLEANUP] Removed old backup: {game_code}")
         except Exception as e:
-            print(f"[CLEANUP ERROR] Skipping file: {e}")
+            print(f"[CLEANUP ERROR] Skipping {game_code}: {e}")
 
 def periodic_cleanup(interval_minutes=60):
-    """Launches a daemon thread that cleans up old backups periodically."""
+    """Launches a daemon thread that cleans up old backups periodically.
+    Only the first call in a process starts it."""
+    global _cleanup_thread
     def loop():
         while True:
-            cleanup_old_backups()
             time.sleep(interval_minutes * 60)
-    threading.Thread(target=loop, daemon=True).start()
+            cleanup_old_backups()
+    with _recovery_lock:
+        if _cleanup_thread is None:
+            _cleanup_thread = threading.Thread(target=loop, name="backup-cleanup", daemon=True)
+            _cleanup_thread.start()
@@ -0,0 +1,287 @@
+# batch_engine.py
+# Lockstep engine that advances thousands of games at once as NumPy arrays.
+#
+#   python batch_engine.py --games 200000 --players 4 --batch 20000 --verify 500
+#
+# Every game plays the same fixed bot policy: the lowest-id card it may play
+# as a single card, otherwise it pays the fine (or takes one card). Games use
+# the rules in game_logic.GameState, and each is seeded with its own
+# random.Random, so a game here ends exactly as play_scalar() plays it with
+# the scalar engine. --verify checks that on the first N seeds.
+#
+# Layout, for N games of P players:
+#   hands    (N, P, 54) card counts      deck, discard (N, 54) ids, plus lengths
+#   top, fine, direction, turn, skip, question rank, requested suit/rank (N,)
+# Deck reshuffles are rare and done per game with that game's own rng.
+
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+from game_logic import (CARD_KEYS, CARD_RANK, CARD_SUIT, FINES, JOKER_SUITS,
+                        PLAYABLE_MASK, RANKS, SUITS, GameState, Player)
+from simulate import play_turn
+
+MAX_TURNS = 1000
+BATCH_SIZE = 10000
+NUM_CARDS = len(CARD_KEYS)
+
+# Card Tables
+
+SUIT_NAMES = SUITS + JOKER_SUITS
+RANK_NAMES = RANKS + ['Joker']
+SUIT_OF = np.array([SUIT_NAMES.index(s) for s in CARD_SUIT], dtype=np.int8)
+RANK_OF = np.array([RANK_NAMES.index(r) for r in CARD_RANK], dtype=np.int8)
+# PLAYABLE[top, card]: the PLAYABLE_MASK bits as a boolean matrix
+PLAYABLE = np.array([[bool(PLAYABLE_MASK[top] >> card & 1) for card in range(NUM_CARDS)]
+                     for top in range(NUM_CARDS)])
+# check_victory() only accepts a win when the card under the top one is plain
+PLAIN_RANK = np.isin(RANK_OF, [RANK_NAMES.index(r) for r in ('4', '5', '6', '7', '8', '9', '10')])
+
+JOKER, ACE, KING, QUEEN, EIGHT, JACK = (
+    RANK_NAMES.index(r) for r in ('Joker', 'A', 'K', 'Q', '8', 'J'))
+
+# Scalar Reference
+
+def lowest_card_policy(moves, rng):
+    """The policy both engines play: the lowest-id single card, or None."""
+    singles = [m for m in moves if len(m) == 1]
+    return min(singles, key=lambda m: m[0].id) if singles else None
+
+def play_scalar(seed, num_players=4, card_count=3, fines=FINES, max_turns=MAX_TURNS):
+    """One game on game_logic.GameState. Returns (winner seat or -1, turns, reshuffles)."""
+    game = GameState(log_file=None, undo_depth=0, rng=random.Random(seed), fines=fines,
+                     log_enabled=False)
+    players = [Player(f"P{i + 1}", None) for i in range(num_players)]
+    game.initialize_game(players, card_count)
+    for turn in range(1, max_turns + 1):
+        winner = play_turn(game, lowest_card_policy, game.rng)
+        if winner:
+            return [p.name for p in players].index(winner), turn, game.reshuffles
+    return -1, max_turns, game.reshuffles
+
+# Batch Engine
+
+class Batch:
+    """N games of `num_players` players, advanced one turn at a time by step()."""
+
+    def __init__(self, seeds, num_players=4, card_count=3, fines=FINES):
+        n = len(seeds)
+        self.n = n
+        self.num_players = num_players
+        self.fine_of = np.zeros(len(RANK_NAMES), dtype=np.int32)
+        for rank, value in fines.items():
+            self.fine_of[RANK_NAMES.index(rank)] = value
+
+        # Same rng calls as GameState: one shuffle for the deck
+        # initialize_game() deals from.
+        self.rngs = [random.Random(seed) for seed in seeds]
+        decks = []
+        for rng in self.rngs:
+            deck = list(range(NUM_CARDS))
+            rng.shuffle(deck)
+            decks.append(deck)
+        deck = np.array(decks, dtype=np.int8).reshape(n, NUM_CARDS)
+
+        rows = np.arange(n)
+        self.hands = np.zeros((n, num_players, NUM_CARDS), dtype=np.uint8)
+        pos = NUM_CARDS - 1  # draw() pops from the end of the list
+        for p in range(num_players):
+            for _ in range(card_count):
+                self.hands[rows, p, deck[:, pos]] = 1
+                pos -= 1
+        self.hand_count = np.full((n, num_players), card_count, dtype=np.int16)
+        self.top = deck[:, pos].astype(np.int16)
+        self.deck = deck
+        self.deck_len = np.full(n, pos, dtype=np.int16)
+        self.discard = np.zeros((n, NUM_CARDS), dtype=np.int8)
+        self.discard_len = np.zeros(n, dtype=np.int16)
+
+        self.fine = np.zeros(n, dtype=np.int32)
+        self.direction = np.ones(n, dtype=np.int8)
+        self.turn = np.zeros(n, dtype=np.int16)
+        self.skip = np.zeros(n, dtype=bool)
+        self.question_rank = np.full(n, -1, dtype=np.int8)   # -1: no question pending
+        self.requested_suit = np.full(n, -1, dtype=np.int8)
+        self.requested_rank = np.full(n, -1, dtype=np.int8)
+
+        self.live = np.ones(n, dtype=bool)
+        self.winner = np.full(n, -1, dtype=np.int16)
+        self.turns = np.zeros(n, dtype=np.int32)
+        self.reshuffles = np.zeros(n, dtype=np.int32)
+
+    # Rules
+
+    def valid_mask(self, g):
+        """(len(g), 54) booleans: is_valid_play() for every card in games g."""
+        top = self.top[g]
+        question = self.question_rank[g][:, None]
+        req_suit = self.requested_suit[g][:, None]
+        req_rank = self.requested_rank[g][:, None]
+        by_question = (RANK_OF == question) | (SUIT_OF == SUIT_OF[top][:, None])
+        by_request = (((req_suit < 0) | (SUIT_OF == req_suit))
+                      & ((req_rank < 0) | (RANK_OF == req_rank)))
+        return np.where(question >= 0, by_question,
+                        np.where((req_suit >= 0) | (req_rank >= 0), by_request, PLAYABLE[top]))
+
+    def step(self):
+        """Plays one turn in every live game. Returns how many games moved."""
+        g = np.flatnonzero(self.live)
+        if not len(g):
+            return 0
+        moved = len(g)
+        seat = self.turn[g]
+        hand = self.hands[g, seat]
+        playable = (hand > 0) & self.valid_mask(g)
+        # legal_moves() offers nothing while another player is cardless
+        others_out = ((self.hand_count[g] == 0).sum(axis=1) - (self.hand_count[g, seat] == 0)) > 0
+        plays = playable.any(axis=1) & ~others_out
+
+        self.turns[g] += 1
+        self._play(g[plays], playable[plays].argmax(axis=1).astype(np.int16))
+        self._draw(g[~plays])
+        self.fine[g[~plays]] = 0
+
+        # Turn order, for games that did not just end
+        g = g[self.live[g]]
+        skip = self.skip[g]
+        step = self.direction[g] * np.where(skip, 2, 1)
+        self.turn[g] = (self.turn[g] + step) % self.num_players
+        self.skip[g] = False
+        self.live[g[self.turns[g] >= MAX_TURNS]] = False
+        return moved
+
+    def _play(self, g, card):
+        rank = RANK_OF[card]
+        seat = self.turn[g]
+
+        self.fine[g] += self.fine_of[rank]
+        self.skip[g] |= (rank == JOKER) | (rank == JACK)
+        ace = rank == ACE
+        self.fine[g[ace]] = 0
+        self.requested_suit[g[ace]] = SUIT_OF[card[ace]]
+        self.requested_rank[g[ace]] = -1
+        king = g[rank == KING]
+        self.direction[king] = -self.direction[king]
+        question = (rank == QUEEN) | (rank == EIGHT)
+        self.question_rank[g[question]] = rank[question]
+
+        self.discard[g, self.discard_len[g]] = self.top[g]
+        self.discard_len[g] += 1
+        self.top[g] = card
+        self.hands[g, seat, card] = 0
+        self.hand_count[g, seat] -= 1
+
+        # check_victory(): one cardless player, and a plain card under the top
+        cardless = (self.hand_count[g] == 0).sum(axis=1)
+        under = self.discard[g, self.discard_len[g] - 1]
+        won = (cardless == 1) & PLAIN_RANK[under] & (self.hand_count[g, seat] == 0)
+        self.winner[g[won]] = seat[won]
+        self.live[g[won]] = False
+
+    def _draw(self, g):
+        count = np.maximum(self.fine[g], 1)
+        for k in range(int(count.max()) if len(g) else 0):
+            g = g[count > k] if k else g
+            count = count[count > k] if k else count
+            empty = g[self.deck_len[g] == 0]
+            for game in empty:
+                self._reshuffle(game)
+            can = self.deck_len[g] > 0
+            g, count = g[can], count[can]
+            seat = self.turn[g]
+            self.deck_len[g] -= 1
+            card = self.deck[g, self.deck_len[g]]
+            self.hands[g, seat, card] += 1
+            self.hand_count[g, seat] += 1
+
+    def _reshuffle(self, game):
+        size = self.discard_len[game]
+        if not size:
+            return
+        pile = self.discard[game, :size].tolist()
+        self.rngs[game].shuffle(pile)
+        self.deck[game, :size] = pile
+        self.deck_len[game] = size
+        self.discard_len[game] = 0
+        self.reshuffles[game] += 1
+
+    def run(self):
+        moves = 0
+        while self.live.any():
+            moves += self.step()
+        return moves
+
+# Running
+
+def run_games(games, num_players=4, card_count=3, seed=0, batch_size=BATCH_SIZE, fines=FINES):
+    """Plays `games` games in batches. Returns per-game results and the move count."""
+    winners, turns, reshuffles = [], [], []
+    moves = 0
+    for start in range(0, games, batch_size):
+        seeds = [seed * 1_000_003 + i for i in range(start, min(games, start + batch_size))]
+        batch = Batch(seeds, num_players, card_count, fines)
+        moves += batch.run()
+        winners.append(batch.winner)
+        turns.append(batch.turns)
+        reshuffles.append(batch.reshuffles)
+    return {
+        'winner': np.concatenate(winners),
+        'turns': np.concatenate(turns),
+        'reshuffles': np.concatenate(reshuffles),
+    }, moves
+
+def verify(games, num_players=4, card_count=3, seed=0, fines=FINES):
+    """Compares the batch engine against play_scalar(); returns mismatching seeds."""
+    results, _ = run_games(games, num_players, card_count, seed, games, fines)
+    bad = []
+    for i in range(games):
+        s = seed * 1_000_003 + i
+        expected = play_scalar(s, num_players, card_count, fines)
+        got = (int(results['winner'][i]), int(results['turns'][i]), int(results['reshuffles'][i]))
+        if got != expected:
+            bad.append((s, expected, got))
+    return bad
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NumPy lockstep self-play")
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--cards', type=int, default=3, help="cards dealt per player")
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help="games per lockstep batch")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verify', type=int, default=0,
+                        help="first check this many games against the scalar engine")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        bad = verify(args.verify, args.players, args.cards, args.seed)
+        for s, expected, got in bad[:10]:
+            print(f"[VERIFY] seed {s}: scalar {expected} batch {got}", file=sys.stderr)
+        print(f"[VERIFY] {args.verify - len(bad)}/{args.verify} games match", file=sys.stderr)
+        if bad:
+            sys.exit(1)
+
+    started = time.time()
+    results, moves = run_games(args.games, args.players, args.cards, args.seed, args.batch)
+    seconds = time.time() - started
+    finished = results['winner'] >= 0
+    print(json.dumps({
+        'games': args.games,
+        'unfinished': int((~finished).sum()),
+        'win_rate_by_seat': [round(float(w), 4) for w in
+                             np.bincount(results['winner'][finished], minlength=args.players)
+                             / max(1, finished.sum())],
+        'avg_turns': round(float(results['turns'].mean()), 2),
+        'reshuffles_per_game': round(float(results['reshuffles'].mean()), 4),
+        'moves': moves,
+        'moves_per_second': round(moves / seconds),
+        'seconds': round(seconds, 2),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
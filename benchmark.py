@@ -0,0 +1,304 @@
+# benchmark.py
+# Micro-benchmarks for the engine, persistence and server hot paths.
+#
+#   python benchmark.py                      # run everything, save results
+#   python benchmark.py --only engine        # names containing "engine"
+#   python benchmark.py --compare benchmark_results/abc1234.json
+#
+# Each benchmark reports seconds per operation (best and median of several
+# repeats). Results are written as JSON named after the git revision, so two
+# revisions can be compared with --compare. DB and backup files are created in
+# a scratch directory and never touch the real game data.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from game_logic import ALL_CARDS, Deck, GameState, Player
+from simulate import play_turn, random_policy
+
+RESULTS_DIR = "benchmark_results"
+REPEATS = 5
+MIN_TIME = 0.2          # seconds each repeat should run for
+REGRESSION_RATIO = 1.2  # --compare flags anything this much slower
+
+BENCHMARKS = []
+
+def benchmark(name):
+    """Registers `setup -> (fn, ops)`: fn() is timed and performs `ops` operations."""
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+def measure(fn, ops, repeats=REPEATS):
+    # Calibrate so one repeat runs for at least MIN_TIME
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(MIN_TIME / elapsed) + 1))
+
+    times = [elapsed]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        times.append(time.perf_counter() - start)
+    per_op = [t / (loops * ops) for t in times]
+    return {'best': min(per_op), 'median': statistics.median(per_op), 'ops': loops * ops * repeats}
+
+# Engine
+
+def new_game(num_players=4, card_count=5, seed=0):
+    game = GameState(log_file=None, rng=random.Random(seed), log_enabled=False)
+    players = [Player(f"P{i + 1}", None) for i in range(num_players)]
+    game.initialize_game(players, card_count)
+    return game
+
+@benchmark("engine.deck_build_shuffle")
+def bench_deck():
+    rng = random.Random(0)
+    return (lambda: Deck(rng=rng)), 1
+
+@benchmark("engine.is_valid_play")
+def bench_is_valid_play():
+    game = new_game()
+    pairs = [(card, top) for top in ALL_CARDS for card in ALL_CARDS]
+    is_valid = game.is_valid_play
+
+    def run():
+        for card, top in pairs:
+            is_valid(card, top)
+    return run, len(pairs)
+
+@benchmark("engine.play_turn")
+def bench_play_turn():
+    """Self-play turns: legal_moves, then play_card or a draw, then next_turn."""
+    rng = random.Random(0)
+    state = {'game': new_game(seed=0)}
+    turns = 1000
+
+    def run():
+        for _ in range(turns):
+            if play_turn(state['game'], random_policy, rng):
+                state['game'] = new_game(seed=rng.random())
+    return run, turns
+
+def big_hand_game(hand_size):
+    """Two players, the first holding `hand_size` cards and a play available."""
+    game = new_game(num_players=2, card_count=1, seed=hand_size)
+    player = game.players[0]
+    game.draw_card(player, hand_size - 1)
+    for card in player.hand:
+        if game.is_valid_play(card):
+            return game, player, card
+    game.set_request(suit=player.hand[0].suit)
+    return game, player, player.hand[0]
+
+for hand_size in (5, 20, 45):
+    @benchmark(f"engine.save_game_state.hand{hand_size}")
+    def bench_save(hand_size=hand_size):
+        game, _, _ = big_hand_game(hand_size)
+        return game.save_game_state, 1
+
+    @benchmark(f"engine.play_undo.hand{hand_size}")
+    def bench_play_undo(hand_size=hand_size):
+        game, player, card = big_hand_game(hand_size)
+
+        def run():
+            game.play_card(player, [card])
+            game.undo_last_move()
+        return run, 1
+
+# Persistence
+
+def db_state(hand_size):
+    game, _, _ = big_hand_game(hand_size)
+    data = game.to_data()
+    state = {k: v for k, v in data.items() if k != 'players'}
+    state['top_card'] = list(state['top_card'])
+    state['deck'] = [list(c) for c in state['deck']]
+    state['discard_pile'] = [list(c) for c in state.pop('discard')]
+    state['log'] = [f"line {i}" for i in range(50)]
+    players = {p['name']: [list(c) for c in p['hand']] for p in data['players']}
+    return state, players
+
+@benchmark("db.save_to_db")
+def bench_db_save():
+    import db
+    state, players = db_state(20)
+    codes = iter(range(10 ** 9))
+
+    def run():
+        # A one-card move each save, like a live table
+        players['P1'].append(players['P1'].pop(0))
+        state['log'].append(f"move {next(codes)}")
+        db.save_to_db("BENCH", state, players)
+    return run, 1
+
+@benchmark("db.load_from_db")
+def bench_db_load():
+    import db
+    state, players = db_state(20)
+    db.save_to_db("BENCHLOAD", state, players)
+    return (lambda: db.load_from_db("BENCHLOAD")), 1
+
+for kb in (1, 16, 128):
+    @benchmark(f"backup.encrypt.{kb}kb")
+    def bench_encrypt(kb=kb):
+        from backup_utils import encrypt_json
+        payload = backup_payload(kb)
+        return (lambda: encrypt_json(payload)), 1
+
+    @benchmark(f"backup.decrypt.{kb}kb")
+    def bench_decrypt(kb=kb):
+        from backup_utils import encrypt_json, decrypt_json
+        data = encrypt_json(backup_payload(kb))
+        return (lambda: decrypt_json(data)), 1
+
+def backup_payload(kb):
+    """A game-shaped dict whose JSON is about `kb` kilobytes."""
+    state, players = db_state(20)
+    line = 0
+    while len(json.dumps(state)) < kb * 1024:
+        state['log'].append(f"P{line % 4 + 1} played ['{ALL_CARDS[line % 54]}'] move {line}")
+        line += 1
+    return {'state': state, 'players': players}
+
+# Server
+
+for clients in (6, 50, 200):
+    @benchmark(f"server.broadcast.{clients}clients")
+    def bench_broadcast(clients=clients):
+        return BroadcastSwarm(clients).start(), 1
+
+class BroadcastSwarm:
+    """Real localhost sockets: one Room.broadcast() until every client has the line."""
+
+    def __init__(self, clients):
+        from server import Room
+        self.clients = clients
+        self.room = Room("bench")
+        self.loop = asyncio.new_event_loop()
+        self.readers = []
+        self.writers = []  # kept open: a collected writer closes its socket
+
+    def start(self):
+        self.loop.run_until_complete(self._connect())
+        return self.run
+
+    async def _connect(self):
+        joined = asyncio.Event()
+
+        async def accept(reader, writer):
+            self.room.players.append(Player(f"C{len(self.room.players)}", writer))
+            if len(self.room.players) == self.clients:
+                joined.set()
+
+        self.server = await asyncio.start_server(accept, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        for _ in range(self.clients):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            self.readers.append(reader)
+            self.writers.append(writer)
+        await joined.wait()
+
+    async def _round(self):
+        self.room.broadcast('turn', v='C0')
+        await asyncio.gather(*(reader.readline() for reader in self.readers))
+
+    def run(self):
+        self.loop.run_until_complete(self._round())
+
+# Running
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_benchmarks(only=None):
+    results = {}
+    for name, setup in BENCHMARKS:
+        if only and not any(pattern in name for pattern in only):
+            continue
+        try:
+            fn, ops = setup()
+            results[name] = measure(fn, ops)
+        except ImportError as e:
+            print(f"[BENCH] Skipping {name}: {e}", file=sys.stderr)
+            continue
+        r = results[name]
+        print(f"{name:40} {r['best'] * 1e6:12.2f} us/op  (median {r['median'] * 1e6:.2f})")
+    return results
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    print(f"\nAgainst {baseline_file}:")
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        ratio = r['best'] / baseline[name]['best']
+        flag = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+        print(f"{name:40} {ratio:8.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Karata benchmarks")
+    parser.add_argument('--only', nargs='*', help="run benchmarks whose name contains any of these")
+    parser.add_argument('--out', help=f"result file (default {RESULTS_DIR}/<revision>.json)")
+    parser.add_argument('--compare', help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    revision = git_revision()
+    out = os.path.abspath(args.out or os.path.join(RESULTS_DIR, f"{revision}.json"))
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    # DB, backup key and backup files all live in a scratch directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            import db
+            db.DB_FILE = os.path.join(scratch, "bench.db")
+            db.init_db()
+            results = run_benchmarks(args.only)
+            db.close_connections()
+        finally:
+            os.chdir(cwd)
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({
+            'revision': revision,
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }, f, indent=2)
+    print(f"\nSaved {out}")
+
+    if baseline and compare(results, baseline):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,46 +2,318 @@
 import sqlite3
 import json
 import os
+import queue
+import threading
+from contextlib import contextmanager
+import metrics
 
 DB_FILE = "karata.db"
+BUSY_TIMEOUT_MS = 5000
+CACHED_STATEMENTS = 128
+POOL_SIZE = 8  # idle connections kept per database file
+LOG_TAIL = 50  # log lines loaded with a game; get_log_tail() serves the rest
+
+# db_file -> queue of idle connections, shared by every thread in the process.
+# Streamlit runs each rerun on a fresh thread, so per-thread connections
+# would be reopened (and their PRAGMAs rerun) on every page refresh.
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _connect(db_file):
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+@contextmanager
+def get_connection(db_file=None):
+    """Lends an open connection to db_file for one transaction.
+
+    Use it as `with get_connection() as conn:`; the block commits on success
+    and rolls back on error, then the connection goes back to the pool. Pooled
+    connections run in WAL mode so readers never block the writer, and keep
+    their prepared statements cached.
+    """
+    db_file = db_file or DB_FILE
+    pool = _pools.get(db_file)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_file, queue.Queue(POOL_SIZE))
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _connect(db_file)
+    try:
+        with conn:
+            yield conn
+    finally:
+        # Any failed transaction was rolled back above, so it can be reused
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def close_connections():
+    """Closes every idle pooled connection (e.g. before deleting the files)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+def _forget_pools():
+    # Connections must not cross a fork; the child opens its own
+    _pools.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pools)
+
+class StaleGameError(Exception):
+    """A conditional save found the game changed since it was loaded."""
+
+# Schema
+# A game is a header row (version plus the scalar fields as JSON), one row per
+# seat for hands, one row per card for the deck and discard pile, and an
+# append-only log. Saving diffs against what is stored, so a move touches a
+# few rows instead of rewriting the whole game. Loads carry only the end of
+# the log: state['log'] holds the lines from seq state['log_start'] on.
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS game_header (
+        game_code TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        meta TEXT NOT NULL,
+        log_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS game_hands (
+        game_code TEXT NOT NULL,
+        seat INTEGER NOT NULL,
+        player TEXT NOT NULL,
+        hand TEXT NOT NULL,
+        PRIMARY KEY (game_code, seat)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS game_cards (
+        game_code TEXT NOT NULL,
+        pile TEXT NOT NULL,
+        pos INTEGER NOT NULL,
+        suit TEXT NOT NULL,
+        rank TEXT NOT NULL,
+        PRIMARY KEY (game_code, pile, pos)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS game_log (
+        game_code TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        line TEXT NOT NULL,
+        PRIMARY KEY (game_code, seq)
+    ) WITHOUT ROWID;
+"""
+
+PILES = ('deck', 'discard_pile')
+ROW_KEYS = PILES + ('log', 'log_start')
+
+# game_code -> last written rows, used to diff the next save. Entries are
+# only trusted while their version matches the header.
+_saved = {}
+_saved_lock = threading.Lock()
 
 def init_db():
     os.makedirs("game_states", exist_ok=True)
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS games (
-                game_code TEXT PRIMARY KEY,
-                state TEXT,
-                players TEXT
-            )
-        """)
-        conn.commit()
+    with get_connection() as conn:
+        conn.executescript(SCHEMA)
+        migrate_json_games(conn)
+
+def migrate_json_games(conn):
+    """Moves rows from the old one-blob `games` table into the new schema."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'games'").fetchone()
+    if not exists:
+        return
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(games)")]
+    version_col = "version" if 'version' in columns else "1"
+    conn.execute("BEGIN IMMEDIATE")
+    rows = conn.execute(f"SELECT game_code, state, players, {version_col} FROM games").fetchall()
+    for game_code, state_json, players_json, version in rows:
+        rows_new = _to_rows(json.loads(state_json), json.loads(players_json))
+        _write_rows(conn, game_code, None, rows_new, max(version, 1))
+    conn.execute("ALTER TABLE games RENAME TO games_json_migrated")
+    conn.commit()
+    print(f"[DB] Migrated {len(rows)} games to the normalized schema")
+
+def _to_rows(state, players):
+    meta = {k: v for k, v in state.items() if k not in ROW_KEYS}
+    rows = {
+        'meta': json.dumps(meta),
+        'hands': [(name, json.dumps(hand)) for name, hand in players.items()],
+        'log': list(state.get('log', [])),
+        'log_start': state.get('log_start', 0),
+    }
+    for pile in PILES:
+        rows[pile] = [(c[0], c[1]) for c in state.get(pile, [])]
+    return rows
+
+def _read_rows(conn, game_code, header):
+    version, meta, log_count = header
+    rows = {'meta': meta, 'log_count': log_count, 'version': version}
+    rows['hands'] = conn.execute(
+        "SELECT player, hand FROM game_hands WHERE game_code = ? ORDER BY seat",
+        (game_code,)).fetchall()
+    for pile in PILES:
+        rows[pile] = conn.execute(
+            "SELECT suit, rank FROM game_cards WHERE game_code = ? AND pile = ? ORDER BY pos",
+            (game_code, pile)).fetchall()
+    return rows
+
+def _write_rows(conn, game_code, old, new, version):
+    """Writes the difference between `old` rows (None for a new game) and `new`."""
+    if old is None:
+        old = {'meta': None, 'hands': [], 'deck': [], 'discard_pile': [], 'log_count': 0}
+        for table in ('game_hands', 'game_cards', 'game_log'):
+            conn.execute(f"DELETE FROM {table} WHERE game_code = ?", (game_code,))
 
-def save_to_db(game_code, state, players):
-    state_json = json.dumps(state)
-    players_json = json.dumps(players)
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT OR REPLACE INTO games (game_code, state, players)
-            VALUES (?, ?, ?)
-        """, (game_code, state_json, players_json))
+    log, log_start = new['log'], new['log_start']
+    log_count = log_start + len(log)
+    # Normally only lines past the stored end are new; a log that starts
+    # later or ends earlier than what is stored replaces it from log_start.
+    first_new = old['log_count'] if log_start <= old['log_count'] <= log_count else log_start
+    if first_new < old['log_count']:
+        conn.execute("DELETE FROM game_log WHERE game_code = ? AND seq >= ?",
+                     (game_code, first_new))
+    conn.executemany(
+        "INSERT INTO game_log (game_code, seq, line) VALUES (?, ?, ?)",
+        [(game_code, seq, log[seq - log_start]) for seq in range(first_new, log_count)])
+
+    conn.execute("""
+        INSERT INTO game_header (game_code, version, meta, log_count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(game_code) DO UPDATE SET
+            version = excluded.version, meta = excluded.meta, log_count = excluded.log_count
+    """, (game_code, version, new['meta'], log_count))
+
+    old_hands, new_hands = old['hands'], new['hands']
+    for seat, hand in enumerate(new_hands):
+        if seat >= len(old_hands) or tuple(old_hands[seat]) != hand:
+            conn.execute(
+                "INSERT OR REPLACE INTO game_hands (game_code, seat, player, hand) VALUES (?, ?, ?, ?)",
+                (game_code, seat, hand[0], hand[1]))
+    if len(old_hands) > len(new_hands):
+        conn.execute("DELETE FROM game_hands WHERE game_code = ? AND seat >= ?",
+                     (game_code, len(new_hands)))
+
+    for pile in PILES:
+        old_cards, new_cards = old[pile], new[pile]
+        keep = 0
+        for a, b in zip(old_cards, new_cards):
+            if tuple(a) != b:
+                break
+            keep += 1
+        if keep < len(old_cards):
+            conn.execute("DELETE FROM game_cards WHERE game_code = ? AND pile = ? AND pos >= ?",
+                         (game_code, pile, keep))
+        conn.executemany(
+            "INSERT INTO game_cards (game_code, pile, pos, suit, rank) VALUES (?, ?, ?, ?, ?)",
+            [(game_code, pile, pos, *new_cards[pos]) for pos in range(keep, len(new_cards))])
+
+@metrics.timed('db_save')
+def save_to_db(game_code, state, players, expected_version=None):
+    """Writes the game and returns its new version.
+
+    With expected_version the write only happens if the stored version still
+    matches (0 means the game must not exist yet); otherwise StaleGameError
+    is raised and nothing is written.
+    """
+    new = _to_rows(state, players)
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        header = conn.execute(
+            "SELECT version, meta, log_count FROM game_header WHERE game_code = ?",
+            (game_code,)).fetchone()
+        current = header[0] if header else 0
+        if expected_version is not None and expected_version != current:
+            raise StaleGameError(f"Game {game_code} changed since version {expected_version}")
+
+        with _saved_lock:
+            old = _saved.get(game_code)
+        if header is None:
+            old = None
+        elif old is None or old['version'] != current:
+            old = _read_rows(conn, game_code, header)
+
+        version = current + 1
+        _write_rows(conn, game_code, old, new, version)
         conn.commit()
 
-def load_from_db(game_code):
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT state, players FROM games WHERE game_code = ?", (game_code,))
-        row = c.fetchone()
-        if not row:
+    new['version'] = version
+    new['log_count'] = new.pop('log_start') + len(new.pop('log'))
+    with _saved_lock:
+        _saved[game_code] = new
+    return version
+
+@metrics.timed('db_load')
+def load_with_version(game_code, log_lines=LOG_TAIL):
+    """Like load_from_db, plus the version the state was read at.
+
+    Only the last `log_lines` log lines are read (all of them for None).
+    """
+    with get_connection() as conn:
+        # One read transaction so the rows all come from the same version
+        conn.execute("BEGIN")
+        header = conn.execute(
+            "SELECT version, meta, log_count FROM game_header WHERE game_code = ?",
+            (game_code,)).fetchone()
+        if not header:
+            conn.rollback()
             raise ValueError(f"Game code {game_code} not found")
-        state = json.loads(row[0])
-        players = json.loads(row[1])
-        return state, players
+        rows = _read_rows(conn, game_code, header)
+        log_start = 0 if log_lines is None else max(0, header[2] - log_lines)
+        log = [row[0] for row in conn.execute(
+            "SELECT line FROM game_log WHERE game_code = ? AND seq >= ? ORDER BY seq",
+            (game_code, log_start))]
+        conn.commit()
+
+    state = json.loads(rows['meta'])
+    for pile in PILES:
+        state[pile] = [list(card) for card in rows[pile]]
+    state['log'] = log
+    state['log_start'] = log_start
+    players = {name: json.loads(hand) for name, hand in rows['hands']}
+    return state, players, rows['version']
+
+def load_from_db(game_code, log_lines=LOG_TAIL):
+    state, players, _ = load_with_version(game_code, log_lines)
+    return state, players
+
+def get_log_tail(game_code, n=3):
+    """Returns the last n log lines of a game, oldest first."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT line FROM game_log WHERE game_code = ? ORDER BY seq DESC LIMIT ?",
+            (game_code, n)).fetchall()
+    return [row[0] for row in reversed(rows)]
+
+def get_version(game_code):
+    """Returns the game's change counter, or None if it does not exist."""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT version FROM game_header WHERE game_code = ?", (game_code,)).fetchone()
+        return row[0] if row else None
 
 def list_games():
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT game_code FROM games")
-        return [row[0] for row in c.fetchall()]
\ No newline at end of file
+    with get_connection() as conn:
+        return [row[0] for row in conn.execute("SELECT game_code FROM game_header")]
+
+# Helpers used by app.py
+
+def save_game_state(game_code, state, players, expected_version=None):
+    return save_to_db(game_code, state, players, expected_version)
+
+def load_game_state(game_code, with_version=False):
+    try:
+        if with_version:
+            return load_with_version(game_code)
+        return load_from_db(game_code)
+    except ValueError:
+        return None
@@ -0,0 +1,143 @@
+# event_store.py
+# Append-only store of engine moves with periodic snapshots.
+#
+# A recorder attached to a GameState appends one small row per move (play,
+# draw, fine, turn, request, reshuffle) and a full snapshot every SNAPSHOT_EVERY
+# events. Any game can be rebuilt by loading its latest snapshot and
+# replaying the events after it; the same stream serves replays, spectators
+# and analytics.
+
+import json
+from db import get_connection
+from game_logic import Card, GameState
+
+SNAPSHOT_EVERY = 50
+
+# Moves that cannot be replayed from the event alone; a snapshot follows them.
+SNAPSHOT_ON = ('start', 'load', 'undo')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS game_events (
+        game_code TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (game_code, seq)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS game_snapshots (
+        game_code TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (game_code, seq)
+    ) WITHOUT ROWID;
+"""
+
+def init_event_store():
+    with get_connection() as conn:
+        conn.executescript(SCHEMA)
+
+class EventRecorder:
+    """Listener that streams one game's moves into the event store."""
+
+    def __init__(self, game_code, game, snapshot_every=SNAPSHOT_EVERY):
+        self.game_code = game_code
+        self.game = game
+        self.snapshot_every = snapshot_every
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT MAX(seq) FROM game_events WHERE game_code = ?", (game_code,)).fetchone()
+            self.seq = row[0] or 0
+            row = conn.execute(
+                "SELECT MAX(seq) FROM game_snapshots WHERE game_code = ?", (game_code,)).fetchone()
+            self.since_snapshot = self.seq - (row[0] or 0)
+
+    def __call__(self, kind, data):
+        self.seq += 1
+        self.since_snapshot += 1
+        with get_connection() as conn:
+            conn.execute(
+                "INSERT INTO game_events (game_code, seq, kind, data) VALUES (?, ?, ?, ?)",
+                (self.game_code, self.seq, kind, json.dumps(data, separators=(',', ':'))))
+            if kind in SNAPSHOT_ON or self.since_snapshot >= self.snapshot_every:
+                self._snapshot(conn)
+
+    def snapshot(self):
+        with get_connection() as conn:
+            self._snapshot(conn)
+
+    def _snapshot(self, conn):
+        conn.execute(
+            "INSERT OR REPLACE INTO game_snapshots (game_code, seq, state) VALUES (?, ?, ?)",
+            (self.game_code, self.seq, json.dumps(self.game.to_data(), separators=(',', ':'))))
+        self.since_snapshot = 0
+
+def record(game_code, game, snapshot_every=SNAPSHOT_EVERY):
+    """Attaches a recorder to `game` and takes a snapshot of where it stands."""
+    recorder = EventRecorder(game_code, game, snapshot_every)
+    game.listeners.append(recorder)
+    if game.players:
+        recorder.snapshot()
+    return recorder
+
+def events(game_code, after_seq=0, upto_seq=None):
+    """Yields (seq, kind, data) for a game in order, e.g. to drive a spectator.
+
+    Only events after `after_seq`, and up to `upto_seq` when given.
+    """
+    sql = "SELECT seq, kind, data FROM game_events WHERE game_code = ? AND seq > ?"
+    params = [game_code, after_seq]
+    if upto_seq is not None:
+        sql += " AND seq <= ?"
+        params.append(upto_seq)
+    with get_connection() as conn:
+        rows = conn.execute(sql + " ORDER BY seq", params).fetchall()
+    for seq, kind, data in rows:
+        yield seq, kind, json.loads(data)
+
+def apply_event(game, kind, data):
+    """Re-applies one recorded move to `game`."""
+    if kind == 'play':
+        player = game.players[data['player']]
+        if not game.play_card(player, [Card.from_tuple(t) for t in data['cards']]):
+            raise ValueError(f"Replay diverged: {player.name} cannot play {data['cards']}")
+    elif kind == 'draw':
+        card = Card.from_tuple(data['card'])
+        game.deck.take(card)
+        game.players[data['player']].hand.append(card)
+    elif kind == 'fine':
+        game.fine = 0
+    elif kind == 'turn':
+        game.next_turn()
+    elif kind == 'request':
+        game.set_request(data['suit'], data['rank'])
+    elif kind == 'reshuffle':
+        game.deck.cards = [Card.from_tuple(t) for t in data['deck']]
+        game.discard_pile.clear()
+        game.reshuffles += 1
+    # 'start', 'load' and 'undo' are always followed by a snapshot
+
+def load_game(game_code, players=None, upto_seq=None, **game_args):
+    """Rebuilds a game from its latest snapshot plus the events after it.
+
+    upto_seq stops the replay early, which gives the table as it stood after
+    that event (for replays and audits). Returns (game, seq) or None, where
+    seq is the last event applied: resume with events(game_code, seq).
+    """
+    game_args.setdefault('log_file', None)
+    with get_connection() as conn:
+        sql = "SELECT seq, state FROM game_snapshots WHERE game_code = ?"
+        params = [game_code]
+        if upto_seq is not None:
+            sql += " AND seq <= ?"
+            params.append(upto_seq)
+        row = conn.execute(sql + " ORDER BY seq DESC LIMIT 1", params).fetchone()
+    if not row:
+        return None
+
+    seq, state = row
+    game = GameState(**game_args)
+    game.load_data(json.loads(state), players)
+    for event_seq, kind, data in events(game_code, seq, upto_seq):
+        apply_event(game, kind, data)
+        seq = event_seq
+    return game, seq
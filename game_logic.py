@@ -3,16 +3,31 @@
 # - Includes skip tracking, undo support, restricted stacking
 # - Auto-play of drawn cards
 # - Logging and disqualification logic improved
+# - Per-table GameState so one process can host many games
+# - Interned cards with precomputed id/suit/rank/point lookup tables
+# - Undo journal of per-move deltas instead of full-table snapshots
+# - Buffered per-game log (see log_buffer.py)
+# - Optional latency metrics on moves (see metrics.py)
+# - Indexed hands: id bitmask, per-rank lookup and running point total
+# - Running table aggregates: cardless players and active-player count
+# - Deck kept as an array of card ids with a draw cursor
 
 import random
 import pickle
 import os
 import copy
+from array import array
+from collections import deque
+from itertools import permutations
+
+import metrics
+from log_buffer import GameLog
 
 SUITS = ['Hearts', 'Diamonds', 'Clubs', 'Spades']
 RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
 LOG_FILE = 'game_log.txt'
 SAVE_FILE = 'game_state.pkl'
+UNDO_DEPTH = 100
 
 CARD_POINTS = {
     'Joker': 300,
@@ -25,19 +40,82 @@ CARD_POINTS = {
     '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9, '10': 10
 }
 
+# Cards added to the running fine when played
+FINES = {'Joker': 5, '2': 2, '3': 3}
+
+JOKER_SUITS = ['Black', 'White']
+
+# Card ids: 0..51 run suit by suit through RANKS, 52/53 are the Jokers.
+CARD_KEYS = [(suit, rank) for suit in SUITS for rank in RANKS]
+CARD_KEYS += [(suit, 'Joker') for suit in JOKER_SUITS]
+CARD_SUIT = [suit for suit, _ in CARD_KEYS]
+CARD_RANK = [rank for _, rank in CARD_KEYS]
+CARD_POINT = [CARD_POINTS[rank] for rank in CARD_RANK]
+
+# Bitmasks over card ids, indexed by card id.
+# MATCH_MASK: cards sharing a suit or rank with the card.
+# PLAYABLE_MASK: cards that may go on the card as top card when no request
+# or question is pending (includes the Joker colour rules).
+JOKER_COLOURS = {'Black': ('Spades', 'Clubs'), 'White': ('Hearts', 'Diamonds')}
+
+def _mask(ids):
+    m = 0
+    for i in ids:
+        m |= 1 << i
+    return m
+
+MATCH_MASK = [
+    _mask(j for j, (s, r) in enumerate(CARD_KEYS) if s == suit or r == rank)
+    for suit, rank in CARD_KEYS
+]
+JOKER_MASK = _mask(j for j, r in enumerate(CARD_RANK) if r == 'Joker')
+# RANK_MASK: every card of a rank, keyed by rank name.
+RANK_MASK = {rank: _mask(j for j, r in enumerate(CARD_RANK) if r == rank)
+             for rank in RANKS + ['Joker']}
+
+def _playable_mask(top_id):
+    suit, rank = CARD_KEYS[top_id]
+    if rank != 'Joker':
+        return MATCH_MASK[top_id] | JOKER_MASK
+    return _mask(
+        j for j, (s, r) in enumerate(CARD_KEYS)
+        if r == 'A' or (r == 'Joker' and s == suit)
+        or (r != 'Joker' and s in JOKER_COLOURS.get(suit, ()))
+    )
+
+PLAYABLE_MASK = [_playable_mask(i) for i in range(len(CARD_KEYS))]
+
 class Card:
-    def __init__(self, suit, rank):
-        self.suit = suit
-        self.rank = rank
+    """One interned card. Card(suit, rank) always returns the same object."""
+
+    __slots__ = ('suit', 'rank', 'id', 'points')
+
+    def __new__(cls, suit, rank):
+        try:
+            return _CARDS_BY_KEY[(suit, rank)]
+        except KeyError:
+            raise ValueError(f"Unknown card: {rank} of {suit}") from None
 
     def matches(self, other):
-        return self.suit == other.suit or self.rank == other.rank
+        return bool(MATCH_MASK[self.id] >> other.id & 1)
 
     def __str__(self):
         return f"{self.rank} of {self.suit}"
 
-    def __eq__(self, other):
-        return self.rank == other.rank and self.suit == other.suit
+    # Equality is the default identity check, which list.index/remove run in
+    # C without calling back into Python.
+    def __hash__(self):
+        return self.id
+
+    # Interned: copies and unpickled cards resolve to the same object.
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (Card, (self.suit, self.rank))
 
     def to_tuple(self):
         return (self.suit, self.rank)
@@ -46,32 +124,262 @@ class Card:
     def from_tuple(t):
         return Card(t[0], t[1])
 
+    @staticmethod
+    def from_id(card_id):
+        return ALL_CARDS[card_id]
+
+def _make_card(card_id):
+    card = object.__new__(Card)
+    card.suit = CARD_SUIT[card_id]
+    card.rank = CARD_RANK[card_id]
+    card.id = card_id
+    card.points = CARD_POINT[card_id]
+    return card
+
+ALL_CARDS = tuple(_make_card(i) for i in range(len(CARD_KEYS)))
+_CARDS_BY_KEY = {key: card for key, card in zip(CARD_KEYS, ALL_CARDS)}
+
+class Hand(list):
+    """A player's cards in order, indexed as they change.
+
+    Alongside the list it keeps a bitmask of card ids (O(1) `in`), so
+    of_rank() finds a rank's cards without scanning, and the running point
+    total. Cards are unique, as in a real deck. When the hand empties or
+    refills, the owning player's table is told (see GameState.cardless).
+    """
+
+    __slots__ = ('mask', 'points', 'owner')
+
+    def __init__(self, cards=()):
+        super().__init__(cards)
+        self.owner = None
+        self._reindex()
+
+    def _reindex(self):
+        self.mask = 0
+        self.points = 0
+        for card in self:
+            self.mask |= 1 << card.id
+            self.points += card.points
+        self._emptied()
+
+    def _add(self, card):
+        was_empty = not self.mask
+        self.mask |= 1 << card.id
+        self.points += card.points
+        if was_empty:
+            self._emptied()
+
+    def _drop(self, card):
+        self.mask &= ~(1 << card.id)
+        self.points -= card.points
+        if not self.mask:
+            self._emptied()
+
+    def _emptied(self):
+        owner = self.owner
+        if owner is not None and owner.table is not None:
+            owner.table._track(owner)
+
+    def __contains__(self, card):
+        try:
+            return bool(self.mask >> card.id & 1)
+        except AttributeError:
+            return False
+
+    def of_rank(self, rank):
+        """The hand's cards of `rank`, in card id order."""
+        bits = self.mask & RANK_MASK[rank]
+        cards = []
+        while bits:
+            low = bits & -bits
+            cards.append(ALL_CARDS[low.bit_length() - 1])
+            bits ^= low
+        return cards
+
+    def append(self, card):
+        super().append(card)
+        self._add(card)
+
+    def insert(self, index, card):
+        super().insert(index, card)
+        self._add(card)
+
+    def extend(self, cards):
+        cards = list(cards)
+        super().extend(cards)
+        for card in cards:
+            self._add(card)
+
+    def __iadd__(self, cards):
+        self.extend(cards)
+        return self
+
+    def remove(self, card):
+        # The mask turns away cards we don't hold without a scan. Removal
+        # itself stays a list shift: play order is part of the state (undo
+        # reinserts at the recorded index) and hands are at most 54 cards.
+        if card not in self:
+            raise ValueError(f"{card!r} is not in the hand")
+        super().remove(card)
+        self._drop(card)
+
+    def pop(self, index=-1):
+        card = super().pop(index)
+        self._drop(card)
+        return card
+
+    def clear(self):
+        super().clear()
+        self.mask = self.points = 0
+        self._emptied()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._reindex()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._reindex()
+
+    def __imul__(self, n):
+        super().__imul__(n)
+        self._reindex()
+        return self
+
+    def __reduce__(self):
+        return (Hand, (list(self),))
+
 class Deck:
-    def __init__(self):
-        self.cards = [Card(suit, rank) for suit in SUITS for rank in RANKS]
-        self.cards += [Card('Black', 'Joker'), Card('White', 'Joker')]
-        random.shuffle(self.cards)
+    """The draw pile as an array of card ids.
+
+    ids[:size] are the cards still in the pile, bottom first; draw() takes
+    ids[size - 1] and moves the cursor down. `cards` gives the old list view.
+    """
+
+    def __init__(self, game=None, rng=random):
+        self.game = game
+        ids = list(range(len(ALL_CARDS)))  # a card's id is its ALL_CARDS index
+        rng.shuffle(ids)
+        self.ids = array('B', ids)
+        self.size = len(ids)
+
+    @classmethod
+    def from_cards(cls, cards, game=None):
+        """A deck holding `cards` in order, without building or shuffling a new one."""
+        deck = cls.__new__(cls)
+        deck.game = game
+        deck.ids = array('B', [c.id for c in cards])
+        deck.size = len(deck.ids)
+        return deck
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def cards(self):
+        return [ALL_CARDS[i] for i in self.ids[:self.size]]
+
+    @cards.setter
+    def cards(self, cards):
+        self.ids = array('B', [c.id for c in cards])
+        self.size = len(self.ids)
+
+    def refill(self, cards, rng=random):
+        """Replaces the pile with `cards`, shuffled."""
+        # Shuffled as a plain list: swapping array items one at a time is
+        # slower, and rng.shuffle() keeps seeded games dealing as before.
+        ids = [c.id for c in cards]
+        rng.shuffle(ids)
+        self.ids = array('B', ids)
+        self.size = len(ids)
 
     def draw(self):
-        if not self.cards:
-            reshuffle_discard_into_deck()
-        return self.cards.pop() if self.cards else None
+        if not self.size and self.game is not None:
+            self.game.reshuffle_discard_into_deck()
+        if not self.size:
+            return None
+        self.size -= 1
+        card = ALL_CARDS[self.ids[self.size]]
+        if self.game is not None:
+            self.game._record(('draw', card))
+        return card
+
+    def push(self, card):
+        """Puts `card` back on top of the pile (undoing a draw)."""
+        if self.size < len(self.ids):
+            self.ids[self.size] = card.id
+        else:
+            self.ids.append(card.id)
+        self.size += 1
+
+    def take(self, card):
+        """Removes `card` from the pile, normally from the top."""
+        if self.size and self.ids[self.size - 1] == card.id:
+            self.size -= 1
+            return
+        index = self.ids[:self.size].index(card.id)
+        del self.ids[index]
+        self.size -= 1
 
     def to_list(self):
-        return [c.to_tuple() for c in self.cards]
+        return [ALL_CARDS[i].to_tuple() for i in self.ids[:self.size]]
 
     @staticmethod
-    def from_list(card_list):
-        d = Deck()
-        d.cards = [Card.from_tuple(t) for t in card_list]
-        return d
+    def from_list(card_list, game=None):
+        return Deck.from_cards([Card.from_tuple(t) for t in card_list], game)
 
 class Player:
     def __init__(self, name, conn):
         self.name = name
         self.conn = conn
+        self.table = None  # the GameState this player is seated at
+        self._eliminated = False
         self.hand = []
-        self.eliminated = False
+
+    @property
+    def hand(self):
+        return self._hand
+
+    @hand.setter
+    def hand(self, cards):
+        # Plain lists are wrapped so the hand's indexes stay in step
+        old = self.__dict__.get('_hand')
+        if old is not None:
+            old.owner = None
+        hand = cards if isinstance(cards, Hand) else Hand(cards)
+        hand.owner = self
+        self._hand = hand
+        if self.table is not None:
+            self.table._track(self)
+
+    @property
+    def eliminated(self):
+        return self._eliminated
+
+    @eliminated.setter
+    def eliminated(self, value):
+        value = bool(value)
+        if value == self._eliminated:
+            return
+        self._eliminated = value
+        if self.table is not None:
+            self.table.active_count += -1 if value else 1
+            self.table._track(self)
+
+    def __getstate__(self):
+        # Leave the table out, or a copy would drag the whole GameState
+        # (locks and log file included) along with it.
+        state = self.__dict__.copy()
+        state.pop('table', None)
+        return state
+
+    def __setstate__(self, state):
+        # Copies and unpickled players get their hand wired back to them and
+        # sit at no table until a GameState seats them.
+        self.__dict__.update(state)
+        self.table = None
+        self._hand.owner = self
 
     def draw_card(self, deck):
         card = deck.draw()
@@ -92,199 +400,441 @@ class Player:
     def load_hand(self, hand_data):
         self.hand = [Card.from_tuple(t) for t in hand_data]
 
-# Global Game State
-deck = Deck()
-players = []
-discard_pile = []
-top_card = None
-fine = 0
-direction = 1
-turn_index = 0
-question_card_pending = False
-question_card_rank = None
-requested_suit = None
-requested_rank = None
-skip_next = False
-move_stack = []
-
-# Logging
-
-def log(msg):
-    with open(LOG_FILE, 'a') as f:
-        f.write(msg + '\n')
 
-# Initialization
+# Game State
+
+class GameState:
+    """All state for one table. A process can hold any number of these."""
+
+    def __init__(self, log_file=None, undo_depth=UNDO_DEPTH, rng=random, fines=FINES,
+                 log_enabled=True):
+        # Logs stay in memory unless log_file names a file for this table
+        # alone; log_enabled=False drops them.
+        self.logger = GameLog(log_file, log_enabled)
+        self.rng = rng
+        self.fines = fines
+        # Empty until initialize_game() or load_data() fills it
+        self.deck = Deck.from_cards((), self)
+        # Kept up to date as hands change, so turn checks never scan the table
+        self.cardless = set()   # seated players with no cards, not eliminated
+        self.active_count = 0   # seated players not eliminated
+        self._players = []
+        self.discard_pile = []
+        self.top_card = None
+        self.fine = 0
+        self.direction = 1
+        self.turn_index = 0
+        self.question_card_pending = False
+        self.question_card_rank = None
+        self.requested_suit = None
+        self.requested_rank = None
+        self.skip_next = False
+        # Undo journal: one entry per play_card() call, holding the scalar
+        # fields from before the play plus the card moves made since.
+        self.move_stack = deque(maxlen=undo_depth)
+        self.reshuffles = 0
+        # Callables taking (kind, data) for every move; see event_store.py
+        self.listeners = []
+
+    # Seating
+
+    @property
+    def players(self):
+        return self._players
+
+    @players.setter
+    def players(self, players):
+        for p in self._players:
+            if p.table is self:
+                p.table = None
+        self._players = list(players)
+        self.cardless = set()
+        self.active_count = 0
+        for p in self._players:
+            p.table = self
+            self.active_count += not p.eliminated
+            self._track(p)
+
+    def _track(self, player):
+        if not player.hand and not player.eliminated:
+            self.cardless.add(player)
+        else:
+            self.cardless.discard(player)
+
+    def other_cardless(self, player):
+        """True if someone other than `player` has gone out of cards."""
+        cardless = self.cardless
+        return bool(cardless) and (len(cardless) > 1 or player not in cardless)
+
+    # Events
+
+    def _emit(self, kind, **data):
+        for listener in self.listeners:
+            listener(kind, data)
+
+    # Logging
+
+    def log(self, msg):
+        self.logger.write(msg)
+
+    def get_log(self, n=None):
+        lines = self.logger.lines(n)
+        return '\n'.join(lines) + '\n' if lines else "No log available."
+
+    # Initialization
+
+    def initialize_game(self, player_list, card_count):
+        self.players = [p for p in player_list if not p.eliminated]
+        self.deck = Deck(self, self.rng)
+        for p in self.players:
+            p.hand = [self.deck.draw() for _ in range(card_count)]
+        self.top_card = self.deck.draw()
+        self.discard_pile = []
+        self.turn_index = 0
+        self.fine = 0
+        self.direction = 1
+        self.question_card_pending = False
+        self.requested_suit = None
+        self.requested_rank = None
+        self.move_stack.clear()
+        self.reshuffles = 0
+        self.logger.reset()
+        self.log(f"Game started. Top card: {self.top_card}")
+        if self.listeners:
+            self._emit('start')
+
+    # Turn Logic
+
+    def next_turn(self):
+        if not self.players:
+            return
+        if self.skip_next:
+            self.skip_next = False
+            self.turn_index = (self.turn_index + self.direction * 2) % len(self.players)
+        else:
+            self.turn_index = (self.turn_index + self.direction) % len(self.players)
+        if self.listeners:
+            self._emit('turn')
+
+    def current_player(self):
+        return self.players[self.turn_index] if self.players else None
+
+    @metrics.timed('engine_draw')
+    def draw_card(self, player, count=1):
+        """Draws up to `count` cards into the player's hand; returns them."""
+        drawn = []
+        for _ in range(count):
+            card = player.draw_card(self.deck)
+            if card is None:
+                break
+            drawn.append(card)
+            if self.listeners:
+                self._emit('draw', player=self.players.index(player), card=card.to_tuple())
+        return drawn
+
+    def take_fine(self, player):
+        """Instead of playing: the player draws the pending fine (or one card
+        when there is none) and the fine is cleared. Returns the cards."""
+        drawn = self.draw_card(player, max(self.fine, 1))
+        if self.fine:
+            self.fine = 0
+            if self.listeners:
+                self._emit('fine', player=self.players.index(player))
+        return drawn
+
+    def set_request(self, suit=None, rank=None):
+        self.requested_suit = suit
+        self.requested_rank = rank
+        if self.listeners:
+            self._emit('request', suit=suit, rank=rank)
+
+    # Deck Maintenance
+
+    def reshuffle_discard_into_deck(self):
+        if self.discard_pile:
+            self.log("Deck empty. Reshuffling discard pile.")
+            if self.move_stack:
+                self._record(('reshuffle', self.deck.cards, self.discard_pile[:]))
+            self.deck.refill(self.discard_pile, self.rng)
+            self.discard_pile.clear()
+            self.reshuffles += 1
+            if self.listeners:
+                self._emit('reshuffle', deck=self.deck.to_list())
+        else:
+            self.log("Deck and discard empty. Cannot reshuffle.")
+
+    # Rule Checks
+
+    def is_valid_play(self, card, top=None):
+        if top is None:
+            top = self.top_card
+
+        if self.question_card_pending:
+            return card.rank == self.question_card_rank or card.suit == top.suit
+
+        if self.requested_suit or self.requested_rank:
+            if self.requested_suit and card.suit != self.requested_suit:
+                return False
+            if self.requested_rank and card.rank != self.requested_rank:
+                return False
+            return True
 
-def initialize_game(player_list, card_count):
-    global players, deck, top_card, turn_index, fine, direction, question_card_pending, discard_pile, requested_suit, requested_rank
-    players = [p for p in player_list if not p.eliminated]
-    deck = Deck()
-    for p in players:
-        p.hand = [deck.draw() for _ in range(card_count)]
-    top_card = deck.draw()
-    discard_pile = []
-    turn_index = 0
-    fine = 0
-    direction = 1
-    question_card_pending = False
-    requested_suit = None
-    requested_rank = None
-    open(LOG_FILE, 'w').close()
-    log(f"Game started. Top card: {top_card}")
-
-# Turn Logic
+        return bool(PLAYABLE_MASK[top.id] >> card.id & 1)
 
-def next_turn():
-    global turn_index, direction, skip_next
-    if not players:
-        return
-    if skip_next:
-        skip_next = False
-        turn_index = (turn_index + direction * 2) % len(players)
-    else:
-        turn_index = (turn_index + direction) % len(players)
+    # Core Play
 
-def current_player():
-    return players[turn_index] if players else None
+    @metrics.timed('engine_play_card')
+    def play_card(self, player, cards):
+        # Every check runs before anything changes, so a refused play leaves
+        # the table (and the undo journal) as it was.
+        if self.logger.enabled:
+            self.log(f"{player.name} played {[str(c) for c in cards]}")
 
-# Deck Maintenance
+        if not cards or len(set(cards)) != len(cards) or not all(c in player.hand for c in cards):
+            self.log("Invalid play: cards not in hand.")
+            return False
 
-def reshuffle_discard_into_deck():
-    global deck, discard_pile
-    if discard_pile:
-        log("Deck empty. Reshuffling discard pile.")
-        random.shuffle(discard_pile)
-        deck.cards = discard_pile[:]
-        discard_pile.clear()
-    else:
-        log("Deck and discard empty. Cannot reshuffle.")
+        if self.other_cardless(player):
+            self.log("Another player is cardless. Cannot finish.")
+            return False
 
-# Rule Checks
+        if not all(c.rank == cards[0].rank for c in cards):
+            self.log("Invalid stack: different ranks.")
+            return False
 
-def is_valid_play(card, top):
-    if question_card_pending:
-        return card.rank == question_card_rank or card.suit == top.suit
+        if cards[0].rank in ['2', '3']:
+            if any(c.rank != cards[0].rank for c in cards):
+                self.log("Invalid fine stack: must be same fine type.")
+                return False
 
-    if requested_suit or requested_rank:
-        if requested_suit and card.suit != requested_suit:
-            return False
-        if requested_rank and card.rank != requested_rank:
+        if not self.is_valid_play(cards[0], self.top_card):
+            self.log("Invalid play: doesn't match top card.")
             return False
+
+        self.move_stack.append({'scalars': self._scalars(), 'moves': []})
+        ace_count = 0
+        for card in cards:
+            if card.rank == 'Joker':
+                self.fine += self.fines['Joker']
+                self.skip_next = True
+            elif card.rank == '2':
+                self.fine += self.fines['2']
+            elif card.rank == '3':
+                self.fine += self.fines['3']
+            elif card.rank == 'A':
+                self.fine = 0
+                ace_count += 1
+            elif card.rank == 'K':
+                self.direction *= -1
+            elif card.rank in ['Q', '8']:
+                self.question_card_pending = True
+                self.question_card_rank = card.rank
+            elif card.rank == 'J':
+                self.skip_next = True
+
+            index = player.hand.index(card)
+            self._record(('play', player, index, card))
+            self.discard_pile.append(self.top_card)
+            self.top_card = card
+            player.hand.pop(index)
+
+        if ace_count == 1:
+            self.requested_suit = self.top_card.suit
+            self.requested_rank = None
+        elif ace_count == 2:
+            self.requested_suit = self.top_card.suit
+            self.requested_rank = self.top_card.rank
+
+        if self.listeners:
+            self._emit('play', player=self.players.index(player), cards=[c.to_tuple() for c in cards])
         return True
 
-    if top.rank == 'Joker':
-        if card.rank == 'A':
-            return True
-        if card.rank == 'Joker':
-            return card.suit == top.suit
-        if top.suit == 'Black':
-            return card.suit in ['Spades', 'Clubs']
-        elif top.suit == 'White':
-            return card.suit in ['Hearts', 'Diamonds']
-        return False
+    # Save/Load/Undo
 
-    return card.matches(top) or card.rank == 'Joker'
+    def save_game_state(self):
+        # The deck points back at this game; seed the memo so deepcopy
+        # does not clone the whole table through that reference.
+        memo = {id(self): self}
+        return {
+            'players': copy.deepcopy(self.players, memo),
+            'deck': copy.deepcopy(self.deck, memo),
+            'discard': copy.deepcopy(self.discard_pile, memo),
+            'top_card': self.top_card,
+            'fine': self.fine,
+            'turn_index': self.turn_index,
+            'direction': self.direction,
+            'skip_next': self.skip_next,
+            'question': self.question_card_pending,
+            'question_rank': self.question_card_rank,
+            'requested_suit': self.requested_suit,
+            'requested_rank': self.requested_rank,
+        }
 
-# Core Play
+    def to_data(self):
+        data = {
+            'deck': self.deck.to_list(),
+            'discard': [c.to_tuple() for c in self.discard_pile],
+            'players': [p.to_data() for p in self.players],
+        }
+        data.update(self._scalars())
+        data['top_card'] = self.top_card.to_tuple() if self.top_card else None
+        return data
+
+    def load_data(self, data, players=None):
+        """Restores a to_data() dict. Existing Player objects are reused by name."""
+        known = {p.name: p for p in players or []}
+        seated = []
+        for pdata in data['players']:
+            p = known.get(pdata['name']) or Player(pdata['name'], None)
+            p.load_hand(pdata['hand'])
+            p.eliminated = pdata.get('eliminated', False)
+            seated.append(p)
+        self.players = seated
+        self.deck = Deck.from_list(data['deck'], self)
+        self.discard_pile = [Card.from_tuple(t) for t in data['discard']]
+        for name in self._scalars():
+            setattr(self, name, data.get(name, getattr(self, name)))
+        self.top_card = Card.from_tuple(data['top_card']) if data['top_card'] else None
+        self.move_stack.clear()
+        if self.listeners:
+            self._emit('load')
+
+    def _scalars(self):
+        return {
+            'top_card': self.top_card,
+            'fine': self.fine,
+            'turn_index': self.turn_index,
+            'direction': self.direction,
+            'skip_next': self.skip_next,
+            'question_card_pending': self.question_card_pending,
+            'question_card_rank': self.question_card_rank,
+            'requested_suit': self.requested_suit,
+            'requested_rank': self.requested_rank,
+        }
 
-def play_card(player, cards):
-    global top_card, fine, direction, question_card_pending, question_card_rank
-    global requested_suit, requested_rank, skip_next, discard_pile
+    def _record(self, move):
+        if self.move_stack:
+            self.move_stack[-1]['moves'].append(move)
+
+    @metrics.timed('engine_undo')
+    def undo_last_move(self):
+        if not self.move_stack:
+            return
+        entry = self.move_stack.pop()
+        for move in reversed(entry['moves']):
+            if move[0] == 'play':
+                _, player, index, card = move
+                self.discard_pile.pop()
+                player.hand.insert(index, card)
+            elif move[0] == 'draw':
+                card = move[1]
+                for p in self.players:
+                    if card in p.hand:
+                        p.hand.remove(card)
+                        break
+                self.deck.push(card)
+            elif move[0] == 'reshuffle':
+                _, deck_cards, discard = move
+                self.deck.cards = deck_cards
+                self.discard_pile = discard
+        for name, value in entry['scalars'].items():
+            setattr(self, name, value)
+        self.log("Move undone.")
+        if self.listeners:
+            self._emit('undo')
+
+    # Victory
+
+    def check_victory(self):
+        if len(self.cardless) != 1:
+            return None
+        if self.discard_pile and self.discard_pile[-1].rank not in ['4','5','6','7','8','9','10']:
+            return None
+        return next(iter(self.cardless)).name
+
+    def get_remaining_players(self):
+        return [p for p in self.players if not p.eliminated]
+
+    def is_game_over(self):
+        return self.active_count <= 1
+
+# Move Generation
+
+def legal_moves(hand, state=None):
+    """Lists every play `hand` could make on `state` without changing it.
+
+    Each move is a list of cards in the order play_card() would take them:
+    a valid lead card followed by any ordering of other cards of its rank.
+    """
+    if state is None:
+        state = _game
+    if state.top_card is None:
+        return []
+    if any(p.hand is not hand for p in state.cardless):
+        return []
+
+    if not isinstance(hand, Hand):
+        hand = Hand(hand)
+
+    moves = []
+    for card in hand:
+        if not state.is_valid_play(card, state.top_card):
+            continue
+        rest = [c for c in hand.of_rank(card.rank) if c is not card]
+        moves.append([card])
+        for size in range(1, len(rest) + 1):
+            for tail in permutations(rest, size):
+                moves.append([card, *tail])
+    return moves
+
+# Default Game
+# The module-level API below drives a single shared table, as before.
+# Hosts running several tables should create their own GameState objects.
+
+_game = GameState(log_file=LOG_FILE)
+
+def __getattr__(name):
+    # Keeps `game_logic.top_card` and friends pointing at the default table.
+    if name in vars(_game) or isinstance(getattr(GameState, name, None), property):
+        return getattr(_game, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    move_stack.append(save_game_state())
-    log(f"{player.name} played {[str(c) for c in cards]}")
+def log(msg):
+    _game.log(msg)
 
-    if any(p != player and not p.hand and not p.eliminated for p in players):
-        log("Another player is cardless. Cannot finish.")
-        return False
+def get_log(n=None):
+    return _game.get_log(n)
 
-    if not all(c.rank == cards[0].rank for c in cards):
-        log("Invalid stack: different ranks.")
-        return False
+def initialize_game(player_list, card_count):
+    _game.initialize_game(player_list, card_count)
 
-    if cards[0].rank in ['2', '3']:
-        if any(c.rank != cards[0].rank for c in cards):
-            log("Invalid fine stack: must be same fine type.")
-            return False
+def next_turn():
+    _game.next_turn()
 
-    if not is_valid_play(cards[0], top_card):
-        log("Invalid play: doesn't match top card.")
-        return False
-
-    ace_count = 0
-    for card in cards:
-        if card.rank == 'Joker':
-            fine += 5
-            skip_next = True
-        elif card.rank == '2':
-            fine += 2
-        elif card.rank == '3':
-            fine += 3
-        elif card.rank == 'A':
-            fine = 0
-            ace_count += 1
-        elif card.rank == 'K':
-            direction *= -1
-        elif card.rank in ['Q', '8']:
-            question_card_pending = True
-            question_card_rank = card.rank
-        elif card.rank == 'J':
-            skip_next = True
-
-        discard_pile.append(top_card)
-        top_card = card
-        player.remove_card(card)
-
-    if ace_count == 1:
-        requested_suit = top_card.suit
-        requested_rank = None
-    elif ace_count == 2:
-        requested_suit = top_card.suit
-        requested_rank = top_card.rank
-
-    return True
-
-# Save/Load/Undo
+def current_player():
+    return _game.current_player()
+
+def reshuffle_discard_into_deck():
+    _game.reshuffle_discard_into_deck()
+
+def is_valid_play(card, top):
+    return _game.is_valid_play(card, top)
+
+def play_card(player, cards):
+    return _game.play_card(player, cards)
 
 def save_game_state():
-    return {
-        'players': copy.deepcopy(players),
-        'deck': copy.deepcopy(deck),
-        'discard': copy.deepcopy(discard_pile),
-        'top_card': top_card,
-        'fine': fine,
-        'turn_index': turn_index,
-        'direction': direction,
-        'skip_next': skip_next,
-        'question': question_card_pending,
-        'question_rank': question_card_rank,
-        'requested_suit': requested_suit,
-        'requested_rank': requested_rank,
-    }
+    return _game.save_game_state()
 
 def undo_last_move():
-    global players, deck, discard_pile, top_card, fine, turn_index, direction, skip_next
-    global question_card_pending, question_card_rank, requested_suit, requested_rank
-    if move_stack:
-        state = move_stack.pop()
-        players = state['players']
-        deck = state['deck']
-        discard_pile = state['discard']
-        top_card = state['top_card']
-        fine = state['fine']
-        turn_index = state['turn_index']
-        direction = state['direction']
-        skip_next = state['skip_next']
-        question_card_pending = state['question']
-        question_card_rank = state['question_rank']
-        requested_suit = state['requested_suit']
-        requested_rank = state['requested_rank']
-        log("Move undone.")
+    _game.undo_last_move()
 
 # Points and Disqualification
 
 def calculate_card_points(hand):
-    return sum(CARD_POINTS.get(c.rank, 0) for c in hand)
+    if isinstance(hand, Hand):
+        return hand.points
+    return sum(c.points for c in hand)
 
 def disqualify_player(players, winner_name):
     return max(
@@ -294,16 +844,10 @@ def disqualify_player(players, winner_name):
     )
 
 def check_victory():
-    global players, discard_pile
-    cardless = [p for p in players if not p.hand and not p.eliminated]
-    if not cardless:
-        return None
-    if discard_pile and discard_pile[-1].rank not in ['4','5','6','7','8','9','10']:
-        return None
-    return cardless[0].name if len(cardless) == 1 else None
+    return _game.check_victory()
 
 def get_remaining_players():
-    return [p for p in players if not p.eliminated]
+    return _game.get_remaining_players()
 
 def is_game_over():
-    return len(get_remaining_players()) <= 1
\ No newline at end of file
+    return _game.is_game_over()
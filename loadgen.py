@@ -0,0 +1,324 @@
+# loadgen.py
+# Drives many bot clients against server.py over localhost sockets.
+#
+#   python loadgen.py --spawn --bots 300 --room-size 4 --seconds 30
+#
+# Bots are split into rooms of --room-size. Each room joins, the host sends
+# /start, and every bot plays a random legal move on its turn (or /draw when
+# it has none), tracking the table from the server's JSON events. When a game
+# ends the room's bots reconnect to a fresh room, until --seconds run out.
+# Latency is measured from writing /play or /draw to receiving the server's
+# broadcast of that move. --spawn starts a local server.py for the run.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from game_logic import Card, GameState, legal_moves
+from server import MAX_PLAYERS, MIN_PLAYERS
+
+HOST = '127.0.0.1'
+PORT = 12345
+READ_TIMEOUT = 0.5    # seconds between checks of the room's stop flag
+REPLY_TIMEOUT = 5.0   # a command unanswered this long counts as stalled
+MAX_TURNS = 2000      # abandon a game that runs longer than this
+
+class Stats:
+    def __init__(self):
+        self.moves = 0
+        self.latencies = []
+        self.errors = Counter()
+        self.games = 0
+        self.abandoned = 0
+        self.connected = 0
+
+    def summary(self, seconds):
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 3) if lat else None
+        return {
+            'seconds': round(seconds, 2),
+            'moves': self.moves,
+            'moves_per_second': round(self.moves / seconds, 1) if seconds else 0,
+            'latency_ms': {'p50': pct(0.50), 'p99': pct(0.99), 'max': pct(1.0)},
+            'games_finished': self.games,
+            'games_abandoned': self.abandoned,
+            'errors': dict(self.errors),
+        }
+
+class Seat:
+    """A player as a bot sees them; opponents' hands hold one None per card."""
+
+    def __init__(self, name):
+        self.name = name
+        self.hand = []
+        self.eliminated = False
+
+class LoadRoom:
+    """One game's worth of bots sharing a server room."""
+
+    def __init__(self, name, size, deadline):
+        self.name = name
+        self.size = size
+        self.deadline = deadline
+        self.turns = 0
+        self.stop = False
+
+    @property
+    def running(self):
+        # Checked on every read as well as enforced by wait_for(): a
+        # cancellation racing a finished read can be lost on Python 3.11.
+        return not self.stop and time.time() < self.deadline
+
+class Bot:
+    def __init__(self, name, room, stats, rng, cards, host, port):
+        self.name = name
+        self.room = room
+        self.stats = stats
+        self.rng = rng
+        self.cards = cards
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+        # Local view of the table. The rule fields live on a GameState so
+        # legal_moves() can read them; the seats are tracked here, since
+        # opponents' hands are only card counts.
+        self.view = GameState(log_file=None, undo_depth=0, log_enabled=False)
+        self.seats = []
+        self.me = None
+        self.turn = None
+        self.sent_at = None
+
+    async def send(self, line):
+        self.writer.write((line + '\n').encode())
+        await self.writer.drain()
+
+    async def read_event(self):
+        line = await asyncio.wait_for(self.reader.readline(), READ_TIMEOUT)
+        if not line:
+            raise ConnectionError("server closed the connection")
+        return json.loads(line)
+
+    async def join(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.stats.connected += 1
+        answers = [self.name, self.room.name]
+        while self.room.running:
+            try:
+                event = await self.read_event()
+            except asyncio.TimeoutError:
+                continue
+            if event['t'] == 'prompt' and answers:
+                await self.send(answers.pop(0))
+            elif event['t'] == 'msg':
+                if event['msg'].startswith("Waiting"):
+                    return
+                raise ConnectionError(event['msg'])
+
+    async def play(self):
+        while self.room.running:
+            try:
+                event = await self.read_event()
+            except asyncio.TimeoutError:
+                if self.sent_at and time.perf_counter() - self.sent_at > REPLY_TIMEOUT:
+                    self.stats.errors['stalled'] += 1
+                    self.room.stop = True
+                continue
+            if self.handle(event):
+                return
+            if self.turn == self.name and self.sent_at is None and self.me is not None:
+                await self.act()
+            elif event['t'] == 'prompt':
+                await self.send(str(self.cards))
+
+    def handle(self, event):
+        """Applies one server event to the local view; True when the game is over."""
+        kind = event['t']
+        view = self.view
+        if kind == 'snapshot':
+            self.seats = [Seat(name) for name in event['players']]
+            for p in self.seats:
+                if p.name == self.name:
+                    p.hand = [Card.from_tuple(tuple(c)) for c in event['hand']]
+                    self.me = p
+                else:
+                    p.hand = [None] * event['players'][p.name]
+            view.top_card = Card.from_tuple(tuple(event['top']))
+            self.set_rules(event['rules'])
+            self.turn = event['turn']
+        elif kind == 'play':
+            cards = [Card.from_tuple(tuple(c)) for c in event['c']]
+            player = self.seat(event['p'])
+            if player is self.me:
+                for card in cards:
+                    player.hand.remove(card)
+                self.answered()
+            else:
+                del player.hand[:len(cards)]
+            view.top_card = cards[-1]
+        elif kind == 'draw':
+            player = self.seat(event['p'])
+            if player is self.me:
+                player.hand.extend(Card.from_tuple(tuple(c)) for c in event['c'])
+                self.answered()
+            else:
+                player.hand.extend([None] * event['n'])
+        elif kind == 'turn':
+            self.turn = event['v']
+        elif kind == 'rules':
+            self.set_rules(event['v'])
+        elif kind == 'fine':
+            view.fine = event['v']
+        elif kind == 'win':
+            if self.me is self.seats[0]:
+                self.stats.games += 1
+            return True
+        elif kind == 'msg' and self.sent_at is not None:
+            # The server refused our command
+            self.stats.errors[event['msg'].split(':')[0]] += 1
+            self.sent_at = None
+            self.room.stop = True
+        return False
+
+    def set_rules(self, rules):
+        question_rank, suit, rank = rules
+        self.view.question_card_pending = question_rank is not None
+        self.view.question_card_rank = question_rank
+        self.view.requested_suit = suit
+        self.view.requested_rank = rank
+
+    def seat(self, name):
+        for p in self.seats:
+            if p.name == name:
+                return p
+        raise KeyError(name)
+
+    def answered(self):
+        if self.sent_at is not None:
+            self.stats.latencies.append(time.perf_counter() - self.sent_at)
+            self.stats.moves += 1
+            self.sent_at = None
+            self.turn = None  # wait for the server's "turn" delta
+
+    async def act(self):
+        self.room.turns += 1
+        if self.room.turns > MAX_TURNS:
+            self.stats.abandoned += 1
+            self.room.stop = True
+            return
+        hand = self.me.hand
+        if any(p is not self.me and not p.hand for p in self.seats):
+            moves = []  # another player is cardless: nobody may finish
+        else:
+            moves = legal_moves(hand, self.view)
+        if moves:
+            move = self.rng.choice(moves)
+            command = "/play " + " ".join(str(hand.index(c) + 1) for c in move)
+        else:
+            command = "/draw"
+        self.sent_at = time.perf_counter()
+        await self.send(command)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+async def play_game(bots, cards):
+    await bots[0].join()  # the first to join is the host
+    await asyncio.gather(*(bot.join() for bot in bots[1:]))
+    if len(bots) < MAX_PLAYERS:  # a full room starts by itself
+        await bots[0].send(f"/start {cards}")
+    await asyncio.gather(*(bot.play() for bot in bots))
+
+async def run_room(index, size, cards, stats, rng, deadline, host, port):
+    generation = 0
+    while time.time() < deadline:
+        generation += 1
+        room = LoadRoom(f"load{index}-{generation}", size, deadline)
+        bots = [Bot(f"bot{index}-{seat}", room, stats, random.Random(rng.random()),
+                    cards, host, port) for seat in range(size)]
+        try:
+            await asyncio.wait_for(play_game(bots, cards), max(0, deadline - time.time()))
+        except asyncio.TimeoutError:
+            pass
+        except (OSError, ConnectionError, ValueError) as e:
+            stats.errors[type(e).__name__] += 1
+            await asyncio.sleep(0.1)
+        finally:
+            for bot in bots:
+                bot.close()
+
+async def run_load(bots, room_size, cards, seconds, seed=0, host=HOST, port=PORT, every=5.0):
+    stats = Stats()
+    rng = random.Random(seed)
+    started = time.time()
+    deadline = started + seconds
+    tasks = [asyncio.create_task(run_room(i, room_size, cards, stats, random.Random(rng.random()),
+                                          deadline, host, port))
+             for i in range(bots // room_size)]
+
+    while not all(t.done() for t in tasks):
+        await asyncio.sleep(min(every, max(0.05, deadline - time.time())))
+        elapsed = time.time() - started
+        if time.time() < deadline:
+            print(f"[LOAD] {elapsed:.0f}s {stats.moves} moves ({stats.moves / elapsed:.0f}/s), "
+                  f"{stats.games} games, {sum(stats.errors.values())} errors", file=sys.stderr)
+    await asyncio.gather(*tasks)
+    return stats.summary(time.time() - started)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+def spawn_server(port):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    proc = subprocess.Popen([sys.executable, script, '--host', HOST, '--port', str(port)],
+                            stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Karata server load generator")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--spawn', action='store_true', help="start a local server.py for the run")
+    parser.add_argument('--bots', type=int, default=100)
+    parser.add_argument('--room-size', type=int, default=4,
+                        choices=range(MIN_PLAYERS, MAX_PLAYERS + 1))
+    parser.add_argument('--cards', type=int, default=3, help="cards dealt per player")
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--every', type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    proc = None
+    if args.spawn:
+        args.host, args.port = HOST, free_port()
+        proc = spawn_server(args.port)
+    try:
+        summary = asyncio.run(run_load(args.bots, args.room_size, args.cards, args.seconds,
+                                       args.seed, args.host, args.port, args.every))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+    summary['bots'] = args.bots // args.room_size * args.room_size
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# log_buffer.py
+# Buffered per-game logs. Recent lines stay in an in-memory ring buffer and
+# a single background thread appends pending lines to disk in batches, so a
+# move costs a list append instead of an open/write/close. The thread starts
+# on the first line queued for disk, not at import, and a forked child starts
+# its own.
+
+import atexit
+import os
+import threading
+import weakref
+from collections import deque
+
+BUFFER_LINES = 500      # recent lines kept in memory per game
+FLUSH_LINES = 200       # wake the flusher early once this many lines are pending
+FLUSH_INTERVAL = 1.0    # seconds between background flushes
+
+class GameLog:
+    def __init__(self, path=None, enabled=True, buffer_lines=BUFFER_LINES):
+        self.path = path
+        self.enabled = enabled
+        self.recent = deque(maxlen=buffer_lines)
+        self._pending = []
+        self._lock = threading.Lock()        # guards _pending; held only briefly
+        self._write_lock = threading.Lock()  # one disk write at a time, in order
+        if path:
+            _flusher.register(self)
+
+    def write(self, msg):
+        if not self.enabled:
+            return
+        self.recent.append(msg)
+        if not self.path:
+            return
+        with self._lock:
+            self._pending.append(msg)
+            pending = len(self._pending)
+        if pending == 1:
+            _flusher.start()
+        elif pending >= FLUSH_LINES:
+            _flusher.wake()
+
+    def reset(self):
+        """Starts a fresh log: clears the buffers and truncates the file."""
+        with self._write_lock, self._lock:
+            self._pending.clear()
+            self.recent.clear()
+            if self.path and self.enabled:
+                open(self.path, 'w').close()
+
+    def flush(self):
+        # The file is written outside _lock, so a move logging meanwhile
+        # only waits for the list swap, never for the disk.
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                with open(self.path, 'a') as f:
+                    f.write('\n'.join(batch) + '\n')
+            except BaseException:
+                with self._lock:
+                    self._pending[:0] = batch  # keep them for the next flush
+                raise
+
+    def lines(self, n=None):
+        lines = list(self.recent)
+        return lines[-n:] if n else lines
+
+    def __del__(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+class _Flusher:
+    """One daemon thread per process that flushes every live GameLog."""
+
+    def __init__(self):
+        self._logs = weakref.WeakSet()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, game_log):
+        with self._lock:
+            self._logs.add(game_log)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-flusher", daemon=True)
+                self._thread.start()
+
+    def _after_fork(self):
+        # The parent's thread does not exist in the child, and the lines it
+        # had queued are the parent's to write.
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        for game_log in self._logs:
+            game_log._lock = threading.Lock()
+            game_log._write_lock = threading.Lock()
+            game_log._pending = []
+
+    def wake(self):
+        self._wake.set()
+
+    def flush_all(self):
+        with self._lock:
+            logs = list(self._logs)
+        for game_log in logs:
+            try:
+                game_log.flush()
+            except OSError as e:
+                print(f"[LOG ERROR] Could not write {game_log.path}: {e}")
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush_all()
+
+_flusher = _Flusher()
+atexit.register(_flusher.flush_all)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_flusher._after_fork)
+
+def flush_all():
+    """Writes out every pending line now (tests, shutdown, admin commands)."""
+    _flusher.flush_all()
@@ -0,0 +1,215 @@
+# metrics.py
+# Counters, gauges and latency histograms for live tables.
+#
+# Off by default: an instrumented call then costs one flag check. Turn it on
+# with enable() or KARATA_METRICS=1, then read it from serve_metrics()
+# (Prometheus text at /metrics, JSON at /metrics.json) or snapshot().
+# server.py serves it with --metrics-port; app.py serves it on
+# KARATA_METRICS_PORT (default METRICS_PORT) whenever KARATA_METRICS is set.
+# toggle_profile() and install_profile_signal() start/stop cProfile and dump
+# the stats to a file, e.g. `kill -USR1 <server pid>` twice.
+
+import cProfile
+import functools
+import json
+import os
+import pstats
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+PROFILE_FILE = 'karata.prof'
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_enabled = os.environ.get('KARATA_METRICS', '') not in ('', '0')
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_gauges = {}      # name -> callable returning the current value
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+def enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+# Recording
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+def inc(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+                break
+        else:
+            hist[len(BUCKETS)] += 1
+        hist[-1] += seconds
+
+def gauge(name, fn):
+    """Registers fn() to be read whenever metrics are exported."""
+    _gauges[name] = fn
+
+def timed(name, **labels):
+    """Decorator: records call latency as `name` and failures as `name`_errors."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                inc(name + '_errors', **labels)
+                raise
+            finally:
+                observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+    return wrap
+
+class timer:
+    """Context manager form of timed() for code that is not a single call."""
+
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter() if _enabled else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is not None:
+            if exc_type is not None:
+                inc(self.name + '_errors', **self.labels)
+            observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+# Export
+
+def snapshot():
+    """Returns every metric as a JSON-ready dict."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+    data = {'counters': [], 'histograms': [], 'gauges': {}}
+    for (name, labels), value in sorted(counters.items()):
+        data['counters'].append({'name': name, 'labels': dict(labels), 'value': value})
+    for (name, labels), hist in sorted(histograms.items()):
+        count = sum(hist[:-1])
+        data['histograms'].append({
+            'name': name, 'labels': dict(labels), 'count': count, 'sum': hist[-1],
+            'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], hist[:-1])),
+        })
+    for name, fn in sorted(_gauges.items()):
+        try:
+            data['gauges'][name] = fn()
+        except Exception as e:
+            print(f"[METRICS ERROR] Gauge {name} failed: {e}")
+    return data
+
+def _labels_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+def prometheus_text():
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+    lines = []
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f"karata_{name}_total{_labels_text(labels)} {value}")
+    for (name, labels), hist in sorted(histograms.items()):
+        running = 0
+        for bound, count in zip([str(b) for b in BUCKETS] + ['+Inf'], hist[:-1]):
+            running += count
+            lines.append(f"karata_{name}_seconds_bucket{_labels_text(labels, [('le', bound)])} {running}")
+        lines.append(f"karata_{name}_seconds_sum{_labels_text(labels)} {hist[-1]}")
+        lines.append(f"karata_{name}_seconds_count{_labels_text(labels)} {running}")
+    for name, value in snapshot()['gauges'].items():
+        lines.append(f"karata_{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, kind = prometheus_text().encode(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, kind = json.dumps(snapshot()).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', kind)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve_metrics(host=METRICS_HOST, port=METRICS_PORT):
+    """Enables metrics and serves them from a daemon thread; returns the server."""
+    enable()
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[METRICS] Serving on http://{host}:{httpd.server_port}/metrics")
+    return httpd
+
+# Profiling
+# cProfile only sees the thread that enabled it; call these from the thread
+# doing the work (the asyncio loop thread for server.py).
+
+_profiler = None
+
+def toggle_profile(path=PROFILE_FILE):
+    """Starts profiling, or stops it and writes the stats to `path`."""
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+        print("[PROFILE] Started")
+        return None
+    _profiler.disable()
+    _profiler.dump_stats(path)
+    stats = pstats.Stats(_profiler)
+    _profiler = None
+    print(f"[PROFILE] Wrote {path}")
+    return stats
+
+def install_profile_signal(signum=getattr(signal, 'SIGUSR1', None), path=PROFILE_FILE):
+    """Toggles the profiler each time the process receives `signum`."""
+    # No SIGUSR1 on Windows, and only the main thread may set handlers
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(signum, lambda *_: toggle_profile(path))
+    return True
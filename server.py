@@ -1,120 +1,325 @@
-import socket
-import threading
-from game_logic import (
-    Player, initialize_game, save_game, load_game,
-    get_log, play_card, deck, current_player,
-    next_turn, is_valid_play, check_victory, sync_all_clients
-)
+# server.py
+# Line-framed protocol: clients send one text command per line (several may
+# arrive in one read); the server answers with one compact JSON event per
+# line. A player gets a full "snapshot" when the game starts or is loaded and
+# small deltas ("play", "draw", "turn", "fine", "dir", "rules") after that.
+#
+# --metrics-port serves counters and command latencies (see metrics.py);
+# SIGUSR1 starts/stops a cProfile dump of the event loop.
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import metrics
+from game_logic import GameState, Player, legal_moves
 
 HOST = '192.168.100.29'
 PORT = 12345
 MIN_PLAYERS = 3
+MAX_PLAYERS = 6
+DEFAULT_CARDS = 3
+DEFAULT_ROOM = 'main'
+# Room names end up in save file names, so keep them to a safe alphabet
+ROOM_NAME = re.compile(r'[A-Za-z0-9_-]{1,32}')
+SAVE_DIR = 'saves'
+# A client whose unsent output grows past this has stopped reading; it is
+# dropped rather than buffered for the life of the process.
+MAX_CLIENT_BUFFER = 256 * 1024
+COMMANDS = ('/start', '/play', '/draw', '/save', '/load', '/log')
+
+# Room name -> Room. Every room runs its own engine on the shared event loop.
+rooms = {}
+
+metrics.gauge('rooms', lambda: len(rooms))
+metrics.gauge('games_active', lambda: sum(r.started for r in list(rooms.values())))
+metrics.gauge('players_connected', lambda: sum(
+    p.conn is not None for r in list(rooms.values()) for p in r.players))
 
-clients = []
+def encode_event(kind, **fields):
+    return (json.dumps({'t': kind, **fields}, separators=(',', ':')) + '\n').encode()
 
-def handle_client(conn, addr):
+def write_to(player, data):
+    conn = player.conn
+    if conn is None:
+        return
     try:
-        conn.sendall("Enter your name: ".encode())
-        name = conn.recv(1024).decode().strip()
+        conn.write(data)
+        if conn.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            print(f"[SERVER] Dropping {player.name}: not reading its events")
+            conn.transport.abort()  # its handler then sees EOF and leaves
+    except Exception:
+        pass
 
-        if any(p.name == name for p in clients):
-            conn.sendall("Name already taken.\n".encode())
-            conn.close()
-            return
+def send_event(player, kind, **fields):
+    write_to(player, encode_event(kind, **fields))
 
-        player = Player(name, conn)
-        clients.append(player)
-        print(f"{name} joined from {addr}")
-        conn.sendall("Waiting for other players...\n".encode())
+def send_to_player(player, msg):
+    send_event(player, 'msg', msg=msg)
 
-        if len(clients) == MAX_PLAYERS:
-            conn.sendall("You are the host. How many cards per player? ".encode())
-            cards_msg = conn.recv(1024).decode().strip()
-            try:
-                cards_per_player = int(cards_msg)
-            except:
-                cards_per_player = 3
+def card_data(card):
+    return list(card.to_tuple()) if card else None
 
-            initialize_game(clients, cards_per_player)
-            sync_all_clients()
+class Room:
+    def __init__(self, name):
+        self.name = name
+        self.players = []
+        self.game = GameState(log_file=None)
+        self.started = False
 
-        while True:
-            msg = conn.recv(1024).decode().strip()
-            if not msg:
+    @property
+    def host(self):
+        return self.players[0] if self.players else None
+
+    def broadcast(self, kind, **fields):
+        data = encode_event(kind, **fields)
+        for p in self.players:
+            write_to(p, data)
+
+    def start(self, cards_per_player):
+        self.game.initialize_game(self.players, cards_per_player)
+        self.started = True
+        self.send_snapshots()
+
+    def public_state(self):
+        game = self.game
+        turn_player = game.current_player()
+        return {
+            'turn': turn_player.name if turn_player else None,
+            'fine': game.fine,
+            'dir': game.direction,
+            'rules': [game.question_card_rank if game.question_card_pending else None,
+                      game.requested_suit, game.requested_rank],
+        }
+
+    def next_turn(self):
+        """Passes the turn on, skipping players who have disconnected."""
+        game = self.game
+        game.next_turn()
+        for _ in range(len(game.players)):
+            if game.current_player().conn is not None:
                 break
+            game.next_turn()
+
+    def send_snapshots(self):
+        """Sends every player the full table; later updates are deltas."""
+        game = self.game
+        table = self.public_state()
+        table['top'] = card_data(game.top_card)
+        table['deck'] = len(game.deck)
+        table['players'] = {p.name: len(p.hand) for p in game.players}
+        for p in self.players:
+            send_event(p, 'snapshot', hand=[card_data(c) for c in p.hand], **table)
+
+    def send_deltas(self, before):
+        """Broadcasts the public fields that changed since `before`."""
+        after = self.public_state()
+        for key in ('fine', 'dir', 'rules', 'turn'):
+            if after[key] != before[key]:
+                self.broadcast(key, v=after[key])
 
-            if current_player() != player:
-                conn.sendall("Not your turn!\n".encode())
-                continue
+    def handle(self, player, msg):
+        game = self.game
 
-            if msg.startswith("/play"):
+        if msg.startswith("/start"):
+            if player is not self.host or self.started:
+                send_to_player(player, "Only the host can start a waiting game.")
+            elif len(self.players) < MIN_PLAYERS:
+                send_to_player(player, f"Need at least {MIN_PLAYERS} players.")
+            else:
+                self.start(parse_card_count(msg.split()[1:]))
+            return
+
+        if not self.started:
+            send_to_player(player, "Waiting for other players...")
+            return
+
+        if game.current_player() is not player:
+            send_to_player(player, "Not your turn!")
+            return
+
+        if msg.startswith("/play"):
+            try:
                 try:
                     indices = [int(x)-1 for x in msg.split()[1:]]
-                    selected_cards = [player.hand[i] for i in indices if 0 <= i < len(player.hand)]
-
-                    if not selected_cards:
-                        conn.sendall("Invalid card indices.\n".encode())
-                        continue
-
-                    # Validate and play each card
-                    if all(is_valid_play(card, current_player().hand[0]) for card in selected_cards):
-                        for card in selected_cards:
-                            if not play_card(player, [card]):  # Pass as list
-                                conn.sendall("Invalid move.\n".encode())
-                                break
-                        else:
-                            winner = check_victory()
-                            if winner:
-                                for p in clients:
-                                    p.conn.sendall(f"{winner} wins!\n".encode())
-                            else:
-                                next_turn()
-                        sync_all_clients()
-                    else:
-                        conn.sendall("Invalid play.\n".encode())
-
-                except Exception as e:
-                    conn.sendall(f"Error: {e}\n".encode())
-
-            elif msg.startswith("/draw"):
-                card = player.draw_card(deck)
-                conn.sendall(f"You drew: {card}\n".encode())
-                next_turn()
-                sync_all_clients()
-
-            elif msg.startswith("/save"):
-                save_game()
-                conn.sendall("Game saved.\n".encode())
-
-            elif msg.startswith("/load"):
-                if load_game([p.conn for p in clients]):
-                    conn.sendall("Game loaded.\n".encode())
-                    sync_all_clients()
+                except ValueError:
+                    indices = []
+                if (not indices or len(set(indices)) != len(indices)
+                        or not all(0 <= i < len(player.hand) for i in indices)):
+                    send_to_player(player, "Invalid card indices.")
+                    return
+                selected_cards = [player.hand[i] for i in indices]
+
+                # Checked before play_card() so a refused play changes nothing
+                if selected_cards not in legal_moves(player.hand, game):
+                    send_to_player(player, "Invalid play.")
+                    return
+
+                before = self.public_state()
+                if not game.play_card(player, selected_cards):
+                    send_to_player(player, "Invalid play.")
+                    return
+
+                self.broadcast('play', p=player.name, c=[card_data(c) for c in selected_cards])
+                winner = game.check_victory()
+                if winner:
+                    self.broadcast('win', p=winner)
                 else:
-                    conn.sendall("No save found.\n".encode())
+                    self.next_turn()
+                self.send_deltas(before)
 
-            elif msg.startswith("/log"):
-                conn.sendall(get_log().encode())
+            except Exception as e:
+                send_to_player(player, f"Error: {e}")
 
-            else:
-                conn.sendall("Unknown command.\n".encode())
+        elif msg.startswith("/draw"):
+            before = self.public_state()
+            drawn = game.draw_card(player)
+            card = drawn[0] if drawn else None
+            for p in self.players:
+                if p is player:
+                    send_event(p, 'draw', p=player.name, c=[card_data(card)] if card else [])
+                else:
+                    send_event(p, 'draw', p=player.name, n=1 if card else 0)
+            self.next_turn()
+            self.send_deltas(before)
+
+        elif msg.startswith("/save"):
+            os.makedirs(SAVE_DIR, exist_ok=True)
+            with open(self.save_file, 'w') as f:
+                json.dump(game.to_data(), f, separators=(',', ':'))
+            send_to_player(player, "Game saved.")
+
+        elif msg.startswith("/load"):
+            try:
+                with open(self.save_file) as f:
+                    data = json.load(f)
+                game.load_data(data, self.players)
+            except FileNotFoundError:
+                send_to_player(player, "No save found.")
+                return
+            except (ValueError, KeyError, TypeError, IndexError) as e:
+                print(f"[LOAD ERROR] {self.save_file}: {e}")
+                send_to_player(player, "Save file is damaged.")
+                return
+            send_to_player(player, "Game loaded.")
+            self.send_snapshots()
+
+        elif msg.startswith("/log"):
+            send_event(player, 'log', lines=game.logger.lines())
+
+        else:
+            send_to_player(player, "Unknown command.")
+
+    @property
+    def save_file(self):
+        # Safe as a path: names are checked against ROOM_NAME on join
+        return os.path.join(SAVE_DIR, f"{self.name}.json")
+
+def parse_card_count(args):
+    try:
+        return int(args[0])
+    except (IndexError, ValueError):
+        return DEFAULT_CARDS
+
+async def prompt(reader, writer, question):
+    writer.write(encode_event('prompt', msg=question))
+    await writer.drain()
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("client closed")
+    return line.decode().strip()
+
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info('peername')
+    metrics.inc('server_connections')
+    room = None
+    player = None
+    try:
+        name = await prompt(reader, writer, "Enter your name: ")
+        room_name = await prompt(reader, writer, f"Room [{DEFAULT_ROOM}]: ") or DEFAULT_ROOM
+        if not ROOM_NAME.fullmatch(room_name):
+            writer.write(encode_event('msg', msg="Room names are 1-32 letters, digits, '_' or '-'."))
+            return
+
+        room = rooms.get(room_name)
+        if room is None:
+            room = rooms[room_name] = Room(room_name)
+
+        if room.started or len(room.players) >= MAX_PLAYERS:
+            writer.write(encode_event('msg', msg="Room is full or already playing."))
+            room = None
+            return
+
+        if not name or any(p.name == name for p in room.players):
+            if not room.players:
+                rooms.pop(room.name, None)
+            writer.write(encode_event('msg', msg="Name already taken."))
+            room = None
+            return
+
+        player = Player(name, writer)
+        room.players.append(player)
+        print(f"{name} joined room {room.name} from {addr}")
+        writer.write(encode_event('msg', msg="Waiting for other players..."))
+
+        if len(room.players) == MAX_PLAYERS:
+            cards_msg = await prompt(reader, writer, "You are the host. How many cards per player? ")
+            if not room.started:
+                room.start(parse_card_count([cards_msg]))
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            msg = line.decode().strip()
+            if msg:
+                command = msg.split()[0]
+                with metrics.timer('server_command',
+                                   command=command if command in COMMANDS else 'other'):
+                    room.handle(player, msg)
+            await writer.drain()
 
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        # ValueError: a line longer than the reader limit; drop the client.
+        pass
     except Exception as e:
         print(f"Error: {e}")
     finally:
-        conn.close()
+        if room is not None:
+            leave_room(room, player)
+        writer.close()
 
-def start_server():
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind((HOST, PORT))
-    s.listen()
+def leave_room(room, player):
+    if player in room.players and not room.started:
+        room.players.remove(player)
+    elif player is not None:
+        player.conn = None
+        # Nobody may wait on a player who has gone
+        if room.started and room.game.current_player() is player:
+            before = room.public_state()
+            room.next_turn()
+            room.send_deltas(before)
+    if all(p.conn is None for p in room.players) or not room.players:
+        rooms.pop(room.name, None)
 
-    print(f"Server started on {HOST}:{PORT}")
+async def serve(host=HOST, port=PORT):
+    metrics.install_profile_signal()
+    server = await asyncio.start_server(handle_client, host, port)
+    print(f"Server started on {host}:{port}")
+    async with server:
+        await server.serve_forever()
 
-    while len(clients) < MAX_PLAYERS:
-        conn, addr = s.accept()
-        threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+def start_server(host=HOST, port=PORT):
+    asyncio.run(serve(host, port))
 
 if __name__ == "__main__":
-    start_server()
+    parser = argparse.ArgumentParser(description="Karata TCP server")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--metrics-port', type=int,
+                        help="serve metrics on 127.0.0.1:PORT (off by default)")
+    args = parser.parse_args()
+    if args.metrics_port:
+        metrics.serve_metrics(port=args.metrics_port)
+    start_server(args.host, args.port)
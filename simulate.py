@@ -0,0 +1,190 @@
+# simulate.py
+# Headless self-play for tuning house rules (card count, fine values).
+#
+#   python simulate.py --games 1000000 --players 4 --workers 8 --seed 7
+#
+# Games are split into fixed-size batches and every batch gets its own seed
+# derived from --seed and the batch number, so results do not depend on how
+# many workers run them.
+
+import argparse
+import json
+import random
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+from game_logic import FINES, GameState, Player, calculate_card_points, disqualify_player, legal_moves
+
+MAX_TURNS = 1000
+BATCH_SIZE = 500
+DQ_BUCKET = 50
+
+# Bot Policies
+
+def random_policy(moves, rng):
+    return rng.choice(moves)
+
+def greedy_policy(moves, rng):
+    # Shed as many points as possible; the heaviest hand is disqualified.
+    return max(moves, key=lambda m: sum(c.points for c in m))
+
+POLICIES = {'random': random_policy, 'greedy': greedy_policy}
+
+# Single Game
+
+def play_turn(game, policy, rng):
+    """Plays one turn for the current player and returns the winner's name, if any.
+
+    `policy(moves, rng)` picks one of the legal moves, or None to pass. With no
+    play the player pays the fine (or takes one card). The turn is passed on
+    unless the game was won.
+    """
+    player = game.current_player()
+    moves = legal_moves(player.hand, game)
+    move = policy(moves, rng) if moves else None
+    if move is not None and game.play_card(player, move):
+        winner = game.check_victory()
+        if winner:
+            return winner
+    else:
+        game.take_fine(player)
+    game.next_turn()
+    return None
+
+def play_game(rng, num_players, card_count, policy, fines=FINES):
+    """Plays one game with logging and undo off. Returns a result dict."""
+    game = GameState(log_file=None, undo_depth=0, rng=rng, fines=fines, log_enabled=False)
+    players = [Player(f"P{i + 1}", None) for i in range(num_players)]
+    game.initialize_game(players, card_count)
+
+    for turn in range(1, MAX_TURNS + 1):
+        winner = play_turn(game, policy, rng)
+        if winner:
+            loser = disqualify_player(players, winner)
+            return {
+                'winner_seat': [p.name for p in players].index(winner),
+                'turns': turn,
+                'dq_points': calculate_card_points(loser.hand) if loser else 0,
+                'reshuffles': game.reshuffles,
+            }
+
+    return {'winner_seat': None, 'turns': MAX_TURNS, 'dq_points': None, 'reshuffles': game.reshuffles}
+
+# Batches
+
+def batch_seed(seed, index):
+    return seed * 1_000_003 + index
+
+def run_batch(job):
+    seed, index, games, num_players, card_count, policy_name, fines = job
+    rng = random.Random(batch_seed(seed, index))
+    policy = POLICIES[policy_name]
+    stats = new_stats(num_players)
+    for _ in range(games):
+        add_result(stats, play_game(rng, num_players, card_count, policy, fines))
+    return stats
+
+def new_stats(num_players):
+    return {
+        'games': 0,
+        'unfinished': 0,
+        'turns': 0,
+        'wins': [0] * num_players,
+        'dq_points': Counter(),
+        'reshuffles': 0,
+        'games_with_reshuffle': 0,
+    }
+
+def add_result(stats, result):
+    stats['games'] += 1
+    stats['turns'] += result['turns']
+    stats['reshuffles'] += result['reshuffles']
+    stats['games_with_reshuffle'] += bool(result['reshuffles'])
+    if result['winner_seat'] is None:
+        stats['unfinished'] += 1
+        return
+    stats['wins'][result['winner_seat']] += 1
+    stats['dq_points'][result['dq_points'] // DQ_BUCKET * DQ_BUCKET] += 1
+
+def merge_stats(total, part):
+    for key in ('games', 'unfinished', 'turns', 'reshuffles', 'games_with_reshuffle'):
+        total[key] += part[key]
+    total['wins'] = [a + b for a, b in zip(total['wins'], part['wins'])]
+    total['dq_points'].update(part['dq_points'])
+
+def summarize(stats):
+    games = stats['games'] or 1
+    finished = (stats['games'] - stats['unfinished']) or 1
+    return {
+        'games': stats['games'],
+        'unfinished': stats['unfinished'],
+        'win_rate_by_seat': [round(w / finished, 4) for w in stats['wins']],
+        'avg_turns': round(stats['turns'] / games, 2),
+        'reshuffles_per_game': round(stats['reshuffles'] / games, 4),
+        'games_with_reshuffle': round(stats['games_with_reshuffle'] / games, 4),
+        'dq_points': {f"{b}-{b + DQ_BUCKET - 1}": n for b, n in sorted(stats['dq_points'].items())},
+    }
+
+def simulate(games, num_players=4, card_count=3, policy='random', workers=1, seed=0,
+             fines=FINES, on_progress=None):
+    """Runs `games` self-play games and returns the summary dict."""
+    jobs = []
+    for index, start in enumerate(range(0, games, BATCH_SIZE)):
+        size = min(BATCH_SIZE, games - start)
+        jobs.append((seed, index, size, num_players, card_count, policy, fines))
+
+    total = new_stats(num_players)
+    if workers > 1:
+        with Pool(workers) as pool:
+            for part in pool.imap(run_batch, jobs):
+                merge_stats(total, part)
+                if on_progress:
+                    on_progress(total)
+    else:
+        for job in jobs:
+            merge_stats(total, run_batch(job))
+            if on_progress:
+                on_progress(total)
+    return summarize(total)
+
+# Command Line
+
+def parse_fines(text):
+    fines = dict(FINES)
+    for item in filter(None, text.split(',')):
+        rank, value = item.split('=')
+        fines[rank.strip()] = int(value)
+    return fines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Karata self-play simulator")
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--cards', type=int, default=3, help="cards dealt per player")
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='random')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fines', default='', help="e.g. Joker=5,2=2,3=3")
+    parser.add_argument('--every', type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    last = [started]
+
+    def progress(total):
+        now = time.time()
+        if now - last[0] >= args.every:
+            last[0] = now
+            rate = total['games'] / (now - started)
+            print(f"[SIM] {total['games']}/{args.games} games ({rate:.0f}/s) "
+                  f"{json.dumps(summarize(total)['win_rate_by_seat'])}", file=sys.stderr)
+
+    summary = simulate(args.games, args.players, args.cards, args.policy,
+                       args.workers, args.seed, parse_fines(args.fines), progress)
+    summary['seconds'] = round(time.time() - started, 2)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
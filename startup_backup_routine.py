@@ -1,7 +1,9 @@
-from backup_utils import restore_db_from_backups, clean_old_backups
+# startup_backup_routine.py
+# Runs backup recovery on its own, e.g. before starting the app:
+#   python startup_backup_routine.py
+from backup_utils import startup_backup_routine
+from db import init_db, list_games, load_from_db
 
-def startup_backup_routine(list_games_fn, save_fn):
-    if not list_games_fn():
-        print("🛠 Restoring DB from backups...")
-        restore_db_from_backups(save_fn)
-    clean_old_backups()
+if __name__ == "__main__":
+    init_db()
+    startup_backup_routine(list_games, load_from_db).join()
@@ -0,0 +1,156 @@
+# test_db.py
+# Storage checks for db.py:
+# - the old one-blob `games` table migrates to the normalized schema
+# - compare-and-swap saves refuse stale versions and write nothing
+# - row-diff saves after a draw, play or reshuffle reload exactly, whether
+#   the diff cache is warm or cold
+# - a log loaded as a tail can be appended to without losing lines
+#
+#   python -m pytest -q test_db.py
+
+import json
+import random
+
+import pytest
+
+import db
+from game_logic import GameState, Player, legal_moves
+
+@pytest.fixture(autouse=True)
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_FILE', str(tmp_path / 'karata.db'))
+    monkeypatch.chdir(tmp_path)  # init_db() creates its backup directory here
+    db._saved.clear()
+    yield
+    db._saved.clear()
+    db.close_connections()
+
+def table_rows(game):
+    """A GameState as the (state, players) dicts app.py saves."""
+    data = game.to_data()
+    state = {k: v for k, v in data.items() if k not in ('players', 'discard')}
+    state['top_card'] = list(state['top_card'])
+    state['deck'] = [list(c) for c in data['deck']]
+    state['discard_pile'] = [list(c) for c in data['discard']]
+    state['log'] = []
+    players = {p['name']: [list(c) for c in p['hand']] for p in data['players']}
+    return state, players
+
+def full_load(game_code):
+    state, players, version = db.load_with_version(game_code, log_lines=None)
+    state.pop('log_start')
+    return state, players, version
+
+# Migration
+
+def test_json_games_migrate():
+    with db.get_connection() as conn:
+        conn.execute("CREATE TABLE games (game_code TEXT PRIMARY KEY, state TEXT, players TEXT, "
+                     "version INTEGER)")
+        state = {'top_card': ['Hearts', '5'], 'deck': [['Clubs', '2'], ['Spades', 'A']],
+                 'discard_pile': [['Hearts', '4']], 'turn_index': 1, 'log': ['a', 'b']}
+        players = {'ann': [['Hearts', 'K']], 'bob': []}
+        conn.execute("INSERT INTO games VALUES (?, ?, ?, ?)",
+                     ('OLD', json.dumps(state), json.dumps(players), 7))
+    db.init_db()
+    assert full_load('OLD') == (state, players, 7)
+    with db.get_connection() as conn:
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'games' not in names and 'games_json_migrated' in names
+
+# Compare-and-swap
+
+def test_stale_save_is_refused():
+    db.init_db()
+    state, players = table_rows(dealt_game(1))
+    assert db.save_to_db('G', state, players, expected_version=0) == 1
+    with pytest.raises(db.StaleGameError):
+        db.save_to_db('G', state, players, expected_version=0)
+
+    mine, _, seen = db.load_with_version('G')
+    theirs, their_players, _ = db.load_with_version('G')
+    theirs['turn_index'] = 2
+    assert db.save_to_db('G', theirs, their_players, expected_version=seen) == 2
+    mine['turn_index'] = 3
+    with pytest.raises(db.StaleGameError):
+        db.save_to_db('G', mine, players, expected_version=seen)
+    assert full_load('G')[0]['turn_index'] == 2
+
+# Row Diffs
+
+def dealt_game(seed, num_players=4, card_count=5):
+    game = GameState(log_file=None, rng=random.Random(seed), log_enabled=False)
+    game.initialize_game([Player(f"P{i + 1}", None) for i in range(num_players)], card_count)
+    return game
+
+@pytest.mark.parametrize('cold', [False, True])
+def test_row_diffs_reload_exactly(cold):
+    db.init_db()
+    rng = random.Random(2)
+    game = dealt_game(2)
+    state, players = table_rows(game)
+    db.save_to_db('G', state, players)
+    kinds = set()
+    for _ in range(400):
+        player = game.current_player()
+        moves = legal_moves(player.hand, game)
+        reshuffles = game.reshuffles
+        if moves and rng.random() < 0.7:
+            game.play_card(player, rng.choice(moves))
+            kinds.add('play')
+        else:
+            game.draw_card(player, rng.randint(1, 8))
+            kinds.add('reshuffle' if game.reshuffles > reshuffles else 'draw')
+        if game.check_victory():
+            break
+        game.next_turn()
+
+        state, players = table_rows(game)
+        if cold:
+            db._saved.clear()  # as after a restart or another process's write
+        version = db.save_to_db('G', state, players)
+        assert full_load('G') == (state, players, version)
+    assert kinds == {'play', 'draw', 'reshuffle'}
+
+def test_save_after_another_writer():
+    # The diff cache holds version 1, but another writer moved the game on
+    db.init_db()
+    game = dealt_game(3)
+    state, players = table_rows(game)
+    db.save_to_db('G', state, players)
+    cached = db._saved['G']
+    game.draw_card(game.players[0], 3)
+    state, players = table_rows(game)
+    db.save_to_db('G', state, players)
+    db._saved['G'] = cached
+
+    game.draw_card(game.players[1], 2)
+    state, players = table_rows(game)
+    version = db.save_to_db('G', state, players)
+    assert full_load('G') == (state, players, version)
+
+# Log Tail
+
+def test_append_after_tail_load():
+    db.init_db()
+    state, players = table_rows(dealt_game(4))
+    state['log'] = [f"line {i}" for i in range(120)]
+    db.save_to_db('G', state, players)
+
+    for cold in (False, True):
+        tail, tail_players, version = db.load_with_version('G')
+        assert len(tail['log']) == db.LOG_TAIL
+        assert tail['log_start'] + len(tail['log']) == len(state['log'])
+        line = f"line {len(state['log'])}"
+        tail['log'].append(line)
+        state['log'].append(line)
+        if cold:
+            db._saved.clear()
+        db.save_to_db('G', tail, tail_players, expected_version=version)
+        assert full_load('G')[0]['log'] == state['log']
+        assert db.get_log_tail('G', 2) == state['log'][-2:]
+
+    # A whole, shorter log still replaces the stored one
+    state['log'] = ['restart']
+    db.save_to_db('G', state, players)
+    assert full_load('G')[0]['log'] == ['restart']